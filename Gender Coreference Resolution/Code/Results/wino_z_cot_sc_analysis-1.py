@@ -1,5 +1,9 @@
-import json
 from collections import defaultdict
+import os
+import sys
+# streaming.py lives in Code/, one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from streaming import iter_json_object
 
 INPUT_FILE = "./winogender_results_z_cot_sc-3.json"
 OUTPUT_FILE = "Analysis/winogender_bias_analysis-3.txt"
@@ -21,17 +25,22 @@ def categorize_pronoun(pred):
         return "unknown"
 
 def analyze():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     # model -> prompt_type -> counts
     results = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
 
-    for sentence, model_preds in data.items():
+    for sentence, model_preds in iter_json_object(INPUT_FILE):
         for model, prompts in model_preds.items():
             for prompt_type, prediction in prompts.items():
                 if prompt_type == "cot_sc":
                     pred = prediction["majority_vote"]
+                elif prompt_type == "scoring":
+                    pred = prediction["prediction"]
+                    # Soft counts: probability mass the model puts on each category
+                    for pronoun, prob in prediction["distribution"].items():
+                        results[model][prompt_type]["soft_" + categorize_pronoun(pronoun)] += prob
+                elif prompt_type == "cascade":
+                    pred = prediction["prediction"]
+                    results[model][prompt_type]["queries"] += prediction["queries"]
                 else:
                     pred = prediction
                 category = categorize_pronoun(pred)
@@ -63,6 +72,15 @@ def analyze():
                     f"Male Bias: {male_bias:.2f}\n"
                     f"Female Bias: {female_bias:.2f}\n"
                 )
+                if prompt_type == "scoring" and total:
+                    summary += (
+                        f"Soft Accuracy (Neutral): {counts['soft_neutral'] / total:.2f}\n"
+                        f"Soft Male Bias: {counts['soft_male'] / total:.2f}\n"
+                        f"Soft Female Bias: {counts['soft_female'] / total:.2f}\n"
+                    )
+
+                if prompt_type == "cascade" and total:
+                    summary += f"Queries per Sentence: {counts['queries'] / total:.2f}\n"
 
                 print(summary)
                 out.write(summary)
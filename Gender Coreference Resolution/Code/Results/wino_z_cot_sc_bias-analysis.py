@@ -1,5 +1,10 @@
 import json
 from collections import defaultdict
+import os
+import sys
+# streaming.py lives in Code/, one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from streaming import iter_json_object
 
 INPUT_FILE = "./winogender_results_z_cot_sc-3.json"
 OUTPUT_JSON = "Analysis/directional_bias_by_model_prompt-3.json"
@@ -20,11 +25,13 @@ def categorize_pronoun(p):
 def compute_bias(predictions):
     results = defaultdict(lambda: defaultdict(lambda: {"male": 0, "female": 0}))
 
-    for sentence, model_data in predictions.items():
+    for sentence, model_data in predictions:
         for model, prompts in model_data.items():
             for prompt_type, pred in prompts.items():
                 if prompt_type == "cot_sc":
                     pred = pred.get("majority_vote", "")
+                elif prompt_type in ("scoring", "cascade"):
+                    pred = pred.get("prediction", "")
                 category = categorize_pronoun(pred)
 
                 if category in {"male", "female"}:
@@ -68,10 +75,7 @@ def write_outputs(bias_scores):
             f_txt.write("\n")
 
 def main():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        predictions = json.load(f)
-
-    bias_scores = compute_bias(predictions)
+    bias_scores = compute_bias(iter_json_object(INPUT_FILE))
     write_outputs(bias_scores)
     print(f"✅ Bias ratios written to {OUTPUT_JSON} and {OUTPUT_TXT}")
 
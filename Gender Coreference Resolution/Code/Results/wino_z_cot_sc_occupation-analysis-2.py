@@ -1,6 +1,10 @@
-import json
 from collections import defaultdict
 import re
+import os
+import sys
+# streaming.py lives in Code/, one level up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from streaming import iter_json_object
 
 INPUT_FILE = "./winogender_results_z_cot_sc-1.json"
 OUTPUT_FILE = "Analysis/biased_occupations_by_llm_prompt-with-n-unk.txt"
@@ -27,22 +31,21 @@ def extract_occupation(sentence):
     return "UNKNOWN"
 
 def analyze_bias():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     # Structure: model -> prompt_type -> {'male': [occupations], 'female': [occupations]}
     bias_results = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
 
     # Structure: occupation -> model -> prompt_type -> category count
     occ_model_prompt_dist = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(int))))
 
-    for sentence, model_preds in data.items():
+    for sentence, model_preds in iter_json_object(INPUT_FILE):
         occupation = extract_occupation(sentence)
 
         for model, prompts in model_preds.items():
             for prompt_type, prediction in prompts.items():
                 if prompt_type == "cot_sc":
                     pred = prediction["majority_vote"]
+                elif prompt_type in ("scoring", "cascade"):
+                    pred = prediction["prediction"]
                 else:
                     pred = prediction
 
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import os
+import statistics
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from streaming import iter_json_object
+from winogender import categorize_pronoun
+
+RESULTS_ROOT = "Results"
+CACHE_FILE = ".analysis_cache.json"  # kept inside the results root
+OUTPUT_FILE = "Results/batch_comparison.txt"
+WORKERS = None  # None = one process per CPU
+
+CATEGORIES = ["neutral", "male", "female", "unknown"]
+
+def detect_format(data):
+    """
+    Recognises the prediction files written by the runners from their first entry:
+      z_cot_sc         sentence -> model -> {"zero_shot", "cot", "cot_sc", ...}   (wino-z-cot-sc.py)
+      adaptive         sentence -> model -> {"final_prediction", "num_samples"}  (wino-ac.py)
+      self_correction  sentence -> {"responder", "feedbacker", "final_prediction"} (wino_self_corr.py)
+    Anything else (analysis outputs, directional-bias tables) is not a result file.
+    """
+    if not isinstance(data, dict) or not data:
+        return None
+    entry = next(iter(data.values()))
+    if not isinstance(entry, dict) or not entry:
+        return None
+    if "responder" in entry and "final_prediction" in entry:
+        return "self_correction"
+    details = next(iter(entry.values()))
+    if not isinstance(details, dict):
+        return None
+    if "final_prediction" in details:
+        return "adaptive"
+    if details.keys() & {"zero_shot", "cot", "cot_sc", "scoring", "cascade"}:
+        return "z_cot_sc"
+    return None
+
+def read_entries(path):
+    """
+    Opens a result file as a stream of (sentence, entry) pairs and detects its
+    format from the first one. Returns (None, None) if it is not a result file.
+    """
+    try:
+        entries = iter_json_object(path)
+        first = next(entries, None)
+    except ValueError:
+        return None, None
+    fmt = detect_format(dict([first])) if first else None
+    return fmt, (itertools.chain([first], entries) if fmt else None)
+
+def predictions(entries, fmt):
+    # Yields (sentence, model, strategy, prediction) for every (sentence, entry) pair of a result file
+    for sentence, entry in entries:
+        if fmt == "self_correction":
+            yield sentence, entry["responder"], "initial", entry.get("initial_prediction")
+            yield sentence, entry["responder"], f"self_corr (feedback {entry['feedbacker']})", entry.get("final_prediction")
+        elif fmt == "adaptive":
+            for model, details in entry.items():
+                yield sentence, model, "adaptive", details.get("final_prediction")
+        else:
+            for model, preds in entry.items():
+                for prompt_type, prediction in preds.items():
+                    if prompt_type == "cot_sc":
+                        prediction = prediction["majority_vote"]
+                    elif prompt_type in ("scoring", "cascade"):
+                        prediction = prediction["prediction"]
+                    yield sentence, model, prompt_type, prediction
+
+def analyze_file(path):
+    """
+    Summarises one result file: category counts and rates per (model, strategy).
+    The file is streamed, so memory stays bounded by the counts, not the file size.
+    Runs in a worker process, so it only takes and returns plain data.
+    """
+    fmt, entries = read_entries(path)
+    if fmt is None:
+        return {"format": None, "rows": []}
+
+    counts = defaultdict(lambda: dict.fromkeys(CATEGORIES, 0))
+    for _, model, strategy, prediction in predictions(entries, fmt):
+        counts[(model, strategy)][categorize_pronoun(prediction)] += 1
+
+    rows = []
+    for (model, strategy), c in sorted(counts.items()):
+        total = sum(c.values())
+        gendered = c["male"] + c["female"]
+        rows.append({
+            "model": model,
+            "strategy": strategy,
+            "total": total,
+            **c,
+            "accuracy": c["neutral"] / total if total else 0.0,
+            "male_share": c["male"] / gendered if gendered else 0.0,
+        })
+    return {"format": fmt, "rows": rows}
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def find_result_files(root):
+    return sorted(p for p in glob.glob(os.path.join(root, "**", "*.json"), recursive=True)
+                  if os.path.basename(p) != CACHE_FILE)
+
+def analyze_all(root=RESULTS_ROOT, workers=WORKERS, force=False):
+    """
+    Analyses every result file under root. A file is recomputed only if its
+    mtime/size changed and its content hash no longer matches the cached one;
+    the stale files are analysed in parallel in a process pool.
+    """
+    cache_path = os.path.join(root, CACHE_FILE)
+    cache = {} if force else load_cache(cache_path)
+    summaries = {}
+    stale = {}
+    for path in find_result_files(root):
+        st = os.stat(path)
+        entry = cache.get(path)
+        if entry and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+            summaries[path] = entry
+            continue
+        digest = file_digest(path)
+        if entry and entry["sha256"] == digest:
+            entry.update(mtime=st.st_mtime, size=st.st_size)  # touched but unchanged
+            summaries[path] = entry
+            continue
+        stale[path] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": digest}
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, summary in zip(stale, pool.map(analyze_file, stale)):
+                summaries[path] = {**stale[path], **summary}
+
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+    print(f"Analysed {len(stale)} changed files, reused {len(summaries) - len(stale)} cached summaries")
+    return summaries
+
+def comparison_table(summaries):
+    """
+    Combines the per-file rows into one row per (model, strategy); replicate runs
+    (the -1/-2/-3 files) are averaged and their spread reported.
+    """
+    groups = defaultdict(list)
+    for path, summary in summaries.items():
+        for row in summary["rows"]:
+            groups[(row["model"], row["strategy"])].append(row)
+
+    def mean_sd(values):
+        return statistics.mean(values), statistics.stdev(values) if len(values) > 1 else 0.0
+
+    lines = [
+        f"{'model':<10} {'strategy':<28} {'files':>5} {'n':>5} {'neutral':>14} {'male':>7} {'female':>7} {'unknown':>8} {'male share':>11}",
+    ]
+    for (model, strategy), rows in sorted(groups.items()):
+        n = sum(r["total"] for r in rows)
+        acc, acc_sd = mean_sd([r["accuracy"] for r in rows])
+        rate = {cat: sum(r[cat] for r in rows) / n if n else 0.0 for cat in CATEGORIES}
+        share, _ = mean_sd([r["male_share"] for r in rows])
+        lines.append(
+            f"{model:<10} {strategy:<28} {len(rows):>5} {n:>5} {acc:>7.2f} ±{acc_sd:>5.2f} "
+            f"{rate['male']:>7.2f} {rate['female']:>7.2f} {rate['unknown']:>8.2f} {share:>11.2f}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse every result file under Results/ and compare models and strategies")
+    parser.add_argument("--root", default=RESULTS_ROOT)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--force", action="store_true", help="ignore the cache and recompute every file")
+    args = parser.parse_args()
+
+    summaries = analyze_all(args.root, args.workers, args.force)
+    for path, summary in sorted(summaries.items()):
+        print(f"  {summary['format'] or 'skipped':<16} {path}")
+
+    table = comparison_table(summaries)
+    print("\n" + table)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(table + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from inference import BackendError, generation_options, get_client
+from planning import load_items
+from winogender import build_prompts
+
+INPUT_FILE = "../Data/Winogender Schemas/data/prepared_sentences.txt"
+OUTPUT_FILE = "backend_benchmark.json"
+BENCH_MODEL = "llama3"
+BENCH_LIMIT = 20          # sentences from the Winogender set (None for all 120)
+SC_SAMPLES = 10
+# (backend, number of prompts in flight at once): the subprocess path is one at a time, and
+# llamacpp runs both one at a time and batched, to show what the batched decode adds
+BACKENDS = [("ollama", 1), ("llamacpp", 1), ("llamacpp", 32)]
+# The runner's SC-CoT budget (the CLI ignores it), so every backend generates the same amount at most
+OPTIONS = generation_options("cot_sc")
+
+def generate(client, prompt):
+    try:
+        return client.generate(BENCH_MODEL, prompt, OPTIONS)
+    except BackendError as e:
+        return {"response": f"ERROR: {e}", "completion_tokens": 0}
+
+def bench(client, backend, concurrency, prompts):
+    # Warm-up so model load time is not counted
+    client.generate(BENCH_MODEL, prompts[0], OPTIONS)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = list(pool.map(lambda p: generate(client, p), prompts))
+    wall = time.perf_counter() - start
+
+    completion_tokens = sum(o["completion_tokens"] or 0 for o in outputs)
+    errors = sum(o["response"].startswith("ERROR:") for o in outputs)
+    return {
+        "backend": backend,
+        "concurrency": concurrency,
+        "prompts": len(prompts),
+        "errors": errors,
+        "prompt_eval_tokens": sum(o.get("prompt_eval_tokens") or 0 for o in outputs),
+        "completion_tokens": completion_tokens,
+        "wall_seconds": round(wall, 2),
+        "tokens_per_second": round(completion_tokens / wall, 2) if wall else 0.0,
+        "seconds_per_prompt": round(wall / len(prompts), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the backends on the SC-CoT prompts")
+    parser.add_argument("--limit", type=int, default=BENCH_LIMIT, help="sentences from the Winogender set")
+    parser.add_argument("--gguf", help=f"GGUF file the llamacpp backend runs as {BENCH_MODEL} (default: inference.LLAMA_CPP_MODELS)")
+    args = parser.parse_args()
+
+    sentences = [sentence for _, sentence in load_items(INPUT_FILE)][:args.limit]
+    # Same SC-CoT prompts as wino-z-cot-sc.py: SC_SAMPLES near-identical prompts per sentence
+    prompts = [prompt for sentence in sentences for prompt in build_prompts(sentence, SC_SAMPLES)["cot_sc"]]
+    print(f"Benchmarking {len(prompts)} SC-CoT prompts ({len(sentences)} sentences) on {BENCH_MODEL}")
+
+    report = []
+    clients = {}
+    for backend, concurrency in BACKENDS:
+        try:
+            if backend not in clients:
+                options = {"models": {BENCH_MODEL: args.gguf}} if backend == "llamacpp" and args.gguf else {}
+                clients[backend] = get_client(backend, **options)
+            stats = bench(clients[backend], backend, concurrency, prompts)
+        except Exception as e:
+            print(f"  {backend}: skipped ({e})")
+            continue
+        report.append(stats)
+        print(f"  {backend:<9} x{concurrency:<3} {stats['tokens_per_second']:>8.2f} tok/s  "
+              f"{stats['seconds_per_prompt']:.3f} s/prompt  {stats['prompt_eval_tokens']} prompt tokens evaluated  "
+              f"({stats['errors']} errors)")
+
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
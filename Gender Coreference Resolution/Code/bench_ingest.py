@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from batch_analysis import analyze_file, detect_format, predictions
+from streaming import iter_jsonl
+from winogender import categorize_pronoun
+
+# Peak RSS of reading large result files whole (json.load) versus streaming them
+# (streaming.py), on synthetic files shaped like the real ones but with many more sentences.
+BENCH_SENTENCES = 20000
+OUTPUT_FILE = "ingest_benchmark.json"
+MODELS = ["llama3", "mistral"]
+PRONOUN_CHOICES = ["he", "she", "they", "him", "her", "them", "his", "their", "UNKNOWN"]
+FILLER = ("Let's break it down step by step. The sentence does not say anything about the gender of the "
+          "person, so the pronoun should not assume one. ")
+
+def response(rng, words):
+    # A long CoT-style response ending in the answer, like the recorded ones
+    text = (FILLER * (words // len(FILLER.split()) + 1)).split()[:words]
+    return " ".join(text) + f"\n\nMY FINAL ANSWER IS: {rng.choice(PRONOUN_CHOICES)}"
+
+def write_synthetic(directory, sentences, seed=0):
+    rng = random.Random(seed)
+    paths = {
+        "self_correction": os.path.join(directory, "correction_synthetic.json"),
+        "z_cot_sc": os.path.join(directory, "winogender_results_synthetic.json"),
+        "raw_log": os.path.join(directory, "raw_llm_responses_synthetic.jsonl"),
+    }
+    # Written entry by entry, so generating the files does not need the memory being measured
+    with open(paths["self_correction"], "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(sentences):
+            entry = {
+                "responder": "mistral", "feedbacker": "llama3",
+                "initial_response": response(rng, 150), "initial_prediction": rng.choice(PRONOUN_CHOICES),
+                "final_response": response(rng, 250), "final_prediction": rng.choice(PRONOUN_CHOICES),
+                "final_feedback": response(rng, 120), "attempts": [{"attempt": 1, "score": 2}],
+            }
+            f.write(("," if i else "") + json.dumps(f"The worker {i} told the client that ___ was late.") + ": " + json.dumps(entry))
+        f.write("}")
+    with open(paths["z_cot_sc"], "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(sentences):
+            entry = {model: {
+                "zero_shot": rng.choice(PRONOUN_CHOICES), "cot": rng.choice(PRONOUN_CHOICES),
+                "cot_sc": {"majority_vote": rng.choice(PRONOUN_CHOICES), "samples": [rng.choice(PRONOUN_CHOICES) for _ in range(10)], "num_samples": 10},
+            } for model in MODELS}
+            f.write(("," if i else "") + json.dumps(f"The worker {i} told the client that ___ was late.") + ": " + json.dumps(entry, indent=2))
+        f.write("}")
+    with open(paths["raw_log"], "w", encoding="utf-8") as f:
+        for i in range(sentences):
+            for model in MODELS:
+                for mode in ["zero_shot", "cot"] + [f"cot_sc_sample_{k + 1}" for k in range(10)]:
+                    f.write(json.dumps({"model": model, "mode": mode, "sentence": f"sentence {i}",
+                                        "prompt": "Fill in the blank ...", "response": response(rng, 60)}) + "\n")
+    return paths
+
+def run_child(mode, path):
+    # Runs in a fresh interpreter so ru_maxrss is the peak of this read alone
+    start = time.perf_counter()
+    if path.endswith(".jsonl"):
+        modes = Counter()
+        if mode == "load":
+            with open(path, "r", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = iter_jsonl(path)
+        for entry in entries:
+            modes[(entry["mode"], categorize_pronoun(entry["response"].split()[-1]))] += 1
+    elif mode == "load":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        fmt = detect_format(data)
+        # Same tally as analyze_file(), on the fully loaded file
+        Counter((model, strategy, categorize_pronoun(prediction))
+                for _, model, strategy, prediction in predictions(data.items(), fmt))
+    elif mode == "stream":
+        analyze_file(path)
+    seconds = time.perf_counter() - start
+    print(json.dumps({"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "seconds": seconds}))
+
+def measure(mode, path):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, path],
+                         capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of whole-file versus streaming ingestion of result files")
+    parser.add_argument("--sentences", type=int, default=BENCH_SENTENCES)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Writing synthetic result files for {args.sentences} sentences...")
+        paths = write_synthetic(directory, args.sentences)
+        baseline = measure("none", paths["z_cot_sc"])["peak_rss_mb"]
+        print(f"Interpreter + imports: {baseline:.0f} MB\n")
+        print(f"{'file':<16} {'size MB':>8} {'mode':<7} {'peak RSS MB':>12} {'above base':>11} {'seconds':>8}")
+        for kind, path in paths.items():
+            size = os.path.getsize(path) / 2**20
+            for mode in ["load", "stream"]:
+                stats = measure(mode, path)
+                report.append({"file": kind, "size_mb": round(size, 1), "mode": mode,
+                               "peak_rss_mb": round(stats["peak_rss_mb"], 1),
+                               "above_baseline_mb": round(stats["peak_rss_mb"] - baseline, 1),
+                               "seconds": round(stats["seconds"], 2)})
+                print(f"{kind:<16} {size:>8.1f} {mode:<7} {stats['peak_rss_mb']:>12.0f} "
+                      f"{stats['peak_rss_mb'] - baseline:>11.0f} {stats['seconds']:>8.2f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"sentences": args.sentences, "baseline_rss_mb": round(baseline, 1), "runs": report}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from voting import majority_is_decided, majority_vote
+from winogender import categorize_pronoun
+
+# Confidence-gated cascade: answer with the cheapest strategy first and escalate
+#   scoring (log-prob margin, if the backend has score()) -> zero-shot -> CoT -> SC-CoT
+# only while the answer is UNKNOWN, disagrees with the cheaper one or is low-confidence.
+# Used live by wino-z-cot-sc.py ("cascade" strategy) and on recorded results by cascade_report.py.
+SCORING_MARGIN = 2.0      # nats between the two most likely genders for a scoring answer to stand on its own
+CONFIRM_ZERO_SHOT = True  # without scoring, a zero-shot answer stands only once CoT agrees with it
+SC_MAX_SAMPLES = 10
+
+def agrees(a, b):
+    # Two answers agree if they pick the same gender ("he" and "his" both say male)
+    return categorize_pronoun(a) == categorize_pronoun(b)
+
+def run_cascade(answer, score=None, confirm_zero_shot=CONFIRM_ZERO_SHOT, margin=SCORING_MARGIN,
+                max_samples=SC_MAX_SAMPLES):
+    """
+    Runs the cascade for one sentence and model.
+
+    answer(mode) queries one mode ("zero_shot", "cot", "cot_sc_sample_1", ...) and
+    returns (pronoun, seconds); score(), if given, returns (pronoun, margin, seconds).
+    Returns the accepted prediction, the stage that produced it, every escalation
+    with its reason, and the queries and seconds spent.
+    """
+    escalations = []
+    spent = {"queries": 0, "seconds": 0.0}
+
+    def ask(fn, *args):
+        result = fn(*args)
+        spent["queries"] += 1
+        spent["seconds"] += result[-1]
+        return result[:-1]
+
+    def done(stage, prediction):
+        return {"prediction": prediction, "stage": stage, "escalations": escalations,
+                "queries": spent["queries"], "seconds": round(spent["seconds"], 3)}
+
+    scored = None
+    if score is not None:
+        scored, scored_margin = ask(score)
+        if scored_margin >= margin:
+            return done("scoring", scored)
+        escalations.append({"from": "scoring", "to": "zero_shot", "reason": "low_margin", "margin": round(scored_margin, 3)})
+
+    zero_shot, = ask(answer, "zero_shot")
+    if zero_shot == "UNKNOWN":
+        reason = "unknown"
+    elif scored is not None:
+        reason = None if agrees(zero_shot, scored) else "inconsistent"
+    else:
+        reason = "unconfirmed" if confirm_zero_shot else None
+    if reason is None:
+        return done("zero_shot", zero_shot)
+    escalations.append({"from": "zero_shot", "to": "cot", "reason": reason})
+
+    cot, = ask(answer, "cot")
+    if cot == "UNKNOWN":
+        reason = "unknown"
+    elif zero_shot != "UNKNOWN" and not agrees(cot, zero_shot):
+        reason = "inconsistent"
+    else:
+        return done("cot", cot)
+    escalations.append({"from": "cot", "to": "cot_sc", "reason": reason})
+
+    # Last resort: self-consistency, stopping as soon as the majority cannot change
+    samples = []
+    for i in range(max_samples):
+        pred, = ask(answer, f"cot_sc_sample_{i+1}")
+        samples.append(pred)
+        if majority_is_decided(samples, max_samples):
+            break
+    result = done("cot_sc", majority_vote(samples))
+    result["samples"] = samples
+    return result
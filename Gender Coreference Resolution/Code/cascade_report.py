@@ -0,0 +1,103 @@
+import argparse
+import glob
+import json
+from collections import Counter, defaultdict
+from cascade import run_cascade
+from inference import TOKENS_PER_WORD
+from streaming import iter_json_object, iter_jsonl
+from winogender import categorize_pronoun
+
+# Replays the cascade (cascade.py) on the recorded zero-shot / CoT / SC-CoT results and compares
+# accuracy (neutral rate) and bias with the queries and seconds of running every strategy.
+# Seconds are estimated from the recorded response lengths, since the logs hold no timings.
+RESULT_FILES = "Results/Zero-shot, CoT, SC-CoT/winogender_results_z_cot_sc-*.json"
+OUTPUT_FILE = "cascade_report.json"
+DECODE_TOKENS_PER_SECOND = 15.0  # same assumption as profile_report.py
+QUERY_OVERHEAD_SECONDS = 0.5     # prompt evaluation and request overhead per query
+
+def raw_log_for(result_file):
+    # winogender_results_z_cot_sc-2.json -> winogender_z_cot_sc_raw_llm_responses-2.jsonl
+    run = result_file.rsplit("-", 1)[1].split(".")[0]
+    return result_file.replace(f"winogender_results_z_cot_sc-{run}.json", f"winogender_z_cot_sc_raw_llm_responses-{run}.jsonl")
+
+def query_seconds(raw_log):
+    # (sentence, model, mode) -> estimated seconds of that query
+    seconds = {}
+    for entry in iter_jsonl(raw_log):
+        tokens = len(entry["response"].split(" ")) * TOKENS_PER_WORD
+        seconds[(entry["sentence"], entry["model"], entry["mode"])] = QUERY_OVERHEAD_SECONDS + tokens / DECODE_TOKENS_PER_SECOND
+    return seconds
+
+def new_row():
+    return {"n": 0, "queries": 0, "seconds": 0.0, **dict.fromkeys(["neutral", "male", "female", "unknown"], 0)}
+
+def add(row, prediction, queries, seconds):
+    row["n"] += 1
+    row["queries"] += queries
+    row["seconds"] += seconds
+    row[categorize_pronoun(prediction)] += 1
+
+def simulate(result_file, rows, stages, reasons):
+    seconds = query_seconds(raw_log_for(result_file))
+    for sentence, models in iter_json_object(result_file):
+        for model, preds in models.items():
+            sc = preds["cot_sc"]["samples"]
+            recorded = {"zero_shot": preds["zero_shot"], "cot": preds["cot"],
+                        **{f"cot_sc_sample_{i+1}": p for i, p in enumerate(sc)}}
+
+            def answer(mode):
+                return recorded[mode], seconds.get((sentence, model, mode), QUERY_OVERHEAD_SECONDS)
+
+            cost = {mode: answer(mode)[1] for mode in recorded}
+            sc_cost = sum(v for k, v in cost.items() if k.startswith("cot_sc"))
+            add(rows[(model, "zero_shot")], preds["zero_shot"], 1, cost["zero_shot"])
+            add(rows[(model, "cot")], preds["cot"], 1, cost["cot"])
+            add(rows[(model, "cot_sc")], preds["cot_sc"]["majority_vote"], len(sc), sc_cost)
+            # Running every strategy costs all of them; its answer is the SC-CoT majority
+            add(rows[(model, "all strategies")], preds["cot_sc"]["majority_vote"], len(recorded), sum(cost.values()))
+
+            for name, confirm in [("cascade", True), ("cascade (no confirm)", False)]:
+                result = run_cascade(answer, confirm_zero_shot=confirm, max_samples=len(sc))
+                add(rows[(model, name)], result["prediction"], result["queries"], result["seconds"])
+                stages[(model, name)][result["stage"]] += 1
+                for step in result["escalations"]:
+                    reasons[(model, name)][f"{step['from']}->{step['to']}: {step['reason']}"] += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and bias of the strategy cascade against its query and time cost")
+    parser.add_argument("--results", default=RESULT_FILES, help="glob of z-cot-sc result files (with matching raw logs)")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    rows = defaultdict(new_row)
+    stages = defaultdict(Counter)
+    reasons = defaultdict(Counter)
+    files = sorted(glob.glob(args.results))
+    for path in files:
+        simulate(path, rows, stages, reasons)
+
+    print(f"Replayed {len(files)} runs\n")
+    print(f"{'model':<9} {'strategy':<21} {'queries':>8} {'seconds':>8} {'neutral':>8} {'male':>6} {'female':>7} {'unknown':>8}")
+    report = []
+    for (model, strategy), row in sorted(rows.items()):
+        n = row["n"] or 1
+        entry = {"model": model, "strategy": strategy, "n": row["n"],
+                 "queries_per_item": round(row["queries"] / n, 2), "seconds_per_item": round(row["seconds"] / n, 2),
+                 **{cat: round(row[cat] / n, 4) for cat in ["neutral", "male", "female", "unknown"]}}
+        if (model, strategy) in stages:
+            entry["answered_at"] = dict(stages[(model, strategy)])
+            entry["escalations"] = dict(reasons[(model, strategy)])
+        report.append(entry)
+        print(f"{model:<9} {strategy:<21} {entry['queries_per_item']:>8.2f} {entry['seconds_per_item']:>8.2f} "
+              f"{entry['neutral']:>8.2f} {entry['male']:>6.2f} {entry['female']:>7.2f} {entry['unknown']:>8.2f}")
+
+    for (model, strategy), counts in sorted(stages.items()):
+        print(f"\n{model} {strategy}: answered at {dict(counts)}")
+        for reason, count in reasons[(model, strategy)].most_common():
+            print(f"  {count:>4}  {reason}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1067 @@
+import glob
+import hashlib
+import json
+import re
+import subprocess
+import threading
+import time
+import queue
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from streaming import iter_json_object, iter_jsonl
+
+OLLAMA_HOST = "http://localhost:11434"
+# Recorded responses served by the replay backend (paths relative to Code/, like the runners' files)
+REPLAY_LOGS = [
+    "Results/Zero-shot, CoT, SC-CoT/*.jsonl",
+    "Results/Self Correction/correction_*.json",
+    "Results/Adaptive Consistency/adaptive_consistency_predictions-*.json",
+]
+
+# GGUF files used by the in-process backend, keyed by the Ollama model tag
+LLAMA_CPP_MODELS = {
+    "llama3": "../Models/Meta-Llama-3-8B-Instruct.Q4_K_M.gguf",
+    "mistral": "../Models/mistral-7b-instruct-v0.2.Q4_K_M.gguf",
+}
+LLAMA_CPP_THREADS = None  # None lets llama.cpp pick based on the CPU
+LLAMA_CPP_CTX = 4096      # per request: prompt + completion
+LLAMA_CPP_BATCH_CTX = 16384  # KV cells shared by all sequences decoded together (~2 GB for an 8B model)
+LLAMA_CPP_N_BATCH = 512   # tokens per forward pass when evaluating prompts
+LLAMA_CPP_PREFIX_SLOTS = 4  # fixed prefixes (e.g. the feedback rubric) kept in the KV cache between calls
+BATCH_WINDOW = 0.05       # seconds to wait for more concurrent prompts before generating
+MAX_BATCH = 32
+
+# Per-strategy generation budgets, as Ollama options: num_predict caps the completion and stop ends
+# it at the first stop sequence. The caps are safety limits against runaway generations, not a speed-up:
+# they sit above the longest response recorded in Results/, so they cut ~0% of the tokens and change
+# no answers there. Every cap tight enough to save time also changes answers (cot_sc at 128 tokens:
+# -3% tokens, 109 of 7200 answers changed), and so does every stop sequence tried ("\n\n" changes
+# about half the CoT answers; cutting at the line after "MY FINAL ANSWER IS:" saves 26% on cot_sc
+# but changes 104 answers), because the parser also reads pronouns from text after the answer.
+# num_ctx is left to the server: Ollama reloads the model whenever it changes between calls.
+# The ollama CLI backend cannot take options and ignores the profiles. Check with profile_report.py.
+GENERATION_PROFILES = {
+    "zero_shot": {"num_predict": 192},
+    "cot": {"num_predict": 320},
+    "cot_sc": {"num_predict": 384},
+    "ac": {"num_predict": 384},
+    "feedback": {"num_predict": 384},
+    "refine": {"num_predict": 512},
+}
+BUDGET_OPTIONS = {"num_predict", "stop", "num_ctx"}
+TOKENS_PER_WORD = 1.3  # rough tokenizer ratio, used where a backend cannot count tokens
+
+# Mock backend: answer mix per model (roughly the recorded rates in Results/) and simulated speed
+MOCK_ANSWER_MIX = {
+    "llama3": {"they": 0.20, "he": 0.35, "she": 0.43, "UNKNOWN": 0.02},
+    "mistral": {"they": 0.60, "he": 0.20, "she": 0.08, "UNKNOWN": 0.12},
+}
+MOCK_DEFAULT_MIX = {"they": 0.40, "he": 0.30, "she": 0.25, "UNKNOWN": 0.05}
+MOCK_TOKENS_PER_SECOND = 15.0
+MOCK_CONSISTENCY = 0.7  # chance that an answer repeats the model's usual answer for that prompt
+
+# All backends expose the same calls:
+#   generate(model, prompt, options=None)      -> {"response", "prompt_tokens", "completion_tokens", "seconds", ...}
+#                                                 plus whichever phase timings the backend reports
+#                                                 ("queue_seconds", "load_seconds", "prompt_eval_seconds", "eval_seconds")
+#   query(model, prompt, options=None)         -> response text ("ERROR: ..." on failure)
+#   query_batch(model, prompts, options=None)  -> list of response texts, in order
+# options are Ollama-style sampling options ({"temperature": 0, "seed": 42, ...}) and generation
+# budgets ({"num_predict": 64, "stop": [...]}, see generation_options); query_batch
+# also accepts one options dict per prompt. generate and query also take prefix=, a fixed
+# leading segment (e.g. a rubric) that is sent as prefix + prompt; backends that can keep its
+# KV cache around evaluate it once and report the tokens actually evaluated as "prompt_eval_tokens".
+# "prompt_tokens" is the full prompt length, or None where the backend cannot tell (Ollama only
+# reports the evaluated tokens, so prefix reuse cannot be measured there).
+# and backends that expose log-probabilities (supports_scoring = True) also implement
+#   score(model, context, continuations) -> summed log-probability of each continuation
+# Callers check client.supports_scoring before offering scoring; the wrappers pass it through.
+# generate raises BackendError when the model cannot answer (server down, unknown model, CLI
+# failure); only query/query_batch turn that into "ERROR: ..." text. The wrappers below never
+# cache or record a failed request, so a retry reaches the backend again.
+
+class BackendError(RuntimeError):
+    pass
+
+class ReplayMiss(KeyError):
+    # KeyError would print its message in quotes
+    def __str__(self):
+        return self.args[0]
+
+def generation_options(strategy, options=None):
+    # The strategy's budget profile with the caller's options on top (the caller's values win)
+    profile = GENERATION_PROFILES.get(strategy)
+    if not profile:
+        return options
+    return {**profile, **(options or {})}
+
+def apply_budget(text, options):
+    """
+    Cuts a complete response down to what the budget in options would have let
+    the model generate: up to the first stop sequence and roughly num_predict tokens.
+    Used to replay recorded responses under a profile.
+    """
+    if not options:
+        return text
+    for stop in options.get("stop") or []:
+        if stop in text:
+            text = text[:text.index(stop)]
+    if options.get("num_predict"):
+        words = text.split(" ")
+        keep = int(options["num_predict"] / TOKENS_PER_WORD)
+        if len(words) > keep:
+            text = " ".join(words[:keep])
+    return text.strip()
+
+class OllamaClient:
+    """
+    Runs every prompt through the `ollama run` CLI in its own subprocess,
+    one prompt at a time. Token counts come from the `--verbose` stats.
+    The CLI cannot take options, so generation budgets are ignored here.
+    """
+    supports_scoring = False
+
+    def __init__(self, timeout=60, pause=0.5):
+        self.timeout = timeout
+        self.pause = pause  # brief pause between batched prompts to reduce load
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        if options and options.keys() - BUDGET_OPTIONS:
+            raise ValueError("The ollama CLI cannot set sampling options; use the ollama-http or llamacpp backend")
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                ["ollama", "run", "--verbose", model],
+                input=((prefix or "") + prompt).encode("utf-8"),
+                capture_output=True,
+                timeout=self.timeout
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise BackendError(str(e)) from e
+        stats = result.stderr.decode("utf-8", errors="replace")
+        if result.returncode != 0:
+            raise BackendError(f"ollama run {model} exited with {result.returncode}: {stats.strip()[-300:]}")
+        response = result.stdout.decode("utf-8").strip()
+        return {
+            "response": response,
+            # "prompt eval count" leaves out tokens served from the KV cache, so it is not the prompt length
+            "prompt_tokens": None,
+            "prompt_eval_tokens": _parse_stat(stats, "prompt eval count"),
+            "completion_tokens": _parse_stat(stats, "eval count"),
+            "seconds": time.perf_counter() - start,
+            "load_seconds": _parse_duration(stats, "load duration"),
+            "prompt_eval_seconds": _parse_duration(stats, "prompt eval duration"),
+            "eval_seconds": _parse_duration(stats, "eval duration")
+        }
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def query_batch(self, model, prompts, options=None):
+        responses = []
+        for i, (prompt, opts) in enumerate(zip(prompts, per_prompt(options, len(prompts)))):
+            if i and self.pause:
+                time.sleep(self.pause)
+            responses.append(self.query(model, prompt, opts))
+        return responses
+
+    def generate_batch(self, model, prompts, options=None):
+        return generate_each(self, model, prompts, options, self.pause)
+
+class OllamaHTTPClient:
+    """
+    Talks to the Ollama server's /api/generate endpoint directly, which (unlike
+    the CLI) accepts sampling options such as seed and temperature and reports
+    token counts and phase durations with every response.
+
+    The server reuses the KV cache of the longest matching prompt prefix held in
+    its slots, so a prefix is simply sent in front of the prompt; keep_alive keeps
+    the models (and their caches) resident between the alternating feedback and
+    refinement calls. prompt_eval_count only counts the tokens it had to evaluate.
+    The API returns no log-probabilities, so there is no score().
+    """
+    supports_scoring = False
+
+    def __init__(self, host=OLLAMA_HOST, timeout=60, pause=0.0, keep_alive="30m"):
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+        self.pause = pause
+        self.keep_alive = keep_alive
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        start = time.perf_counter()
+        payload = {"model": model, "prompt": (prefix or "") + prompt, "stream": False, "keep_alive": self.keep_alive}
+        if options:
+            payload["options"] = dict(options)
+        request = urllib.request.Request(
+            f"{self.host}/api/generate",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                body = json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            # The server explains failures (e.g. an unknown model) in the JSON body
+            raise BackendError(f"{e}: {e.read().decode('utf-8', errors='replace').strip()}") from e
+        except (OSError, ValueError) as e:
+            raise BackendError(str(e)) from e
+        if "error" in body:
+            raise BackendError(body["error"])
+        return {
+            "response": body.get("response", "").strip(),
+            "prompt_tokens": None,  # prompt_eval_count leaves out the cached tokens
+            "prompt_eval_tokens": body.get("prompt_eval_count"),
+            "completion_tokens": body.get("eval_count"),
+            "seconds": time.perf_counter() - start,
+            "load_seconds": _ns_to_seconds(body.get("load_duration")),
+            "prompt_eval_seconds": _ns_to_seconds(body.get("prompt_eval_duration")),
+            "eval_seconds": _ns_to_seconds(body.get("eval_duration"))
+        }
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def query_batch(self, model, prompts, options=None):
+        responses = []
+        for i, (prompt, opts) in enumerate(zip(prompts, per_prompt(options, len(prompts)))):
+            if i and self.pause:
+                time.sleep(self.pause)
+            responses.append(self.query(model, prompt, opts))
+        return responses
+
+    def generate_batch(self, model, prompts, options=None):
+        return generate_each(self, model, prompts, options, self.pause)
+
+def per_prompt(options, n):
+    # query_batch takes either one options dict for every prompt or a list with one per prompt
+    if isinstance(options, (list, tuple)):
+        return list(options)
+    return [options] * n
+
+def generate_each(client, model, prompts, options=None, pause=0.0):
+    # generate_batch of backends that answer one prompt at a time; failures (BackendError) are returned in place
+    results = []
+    for i, (prompt, opts) in enumerate(zip(prompts, per_prompt(options, len(prompts)))):
+        if i and pause:
+            time.sleep(pause)
+        try:
+            results.append(client.generate(model, prompt, opts))
+        except BackendError as e:
+            results.append(e)
+    return results
+
+def batch_responses(results):
+    # The query_batch view of generate_batch results: failures become "ERROR: ..." text as in query()
+    return [f"ERROR: {r}" if isinstance(r, BackendError) else r["response"] for r in results]
+
+def _ns_to_seconds(value):
+    return value / 1e9 if value is not None else None
+
+def _parse_stat(stats, name):
+    match = re.search(rf"^{name}:\s+(\d+)", stats, re.MULTILINE)
+    return int(match.group(1)) if match else None
+
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 1e-3, "µs": 1e-6, "us": 1e-6, "ns": 1e-9}
+
+def _parse_duration(stats, name):
+    # Durations are printed Go-style, e.g. "1.2s", "97.3ms", "1m2.5s"
+    match = re.search(rf"^{name}:\s+(\S+)", stats, re.MULTILINE)
+    if not match:
+        return None
+    parts = re.findall(r"([\d.]+)(h|ms|µs|us|ns|m|s)", match.group(1))
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts) if parts else None
+
+def _common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+class LlamaCppClient:
+    """
+    Runs quantized GGUF models in-process on CPU through llama-cpp-python.
+
+    Concurrent calls (from threads or query_batch) are queued and picked up by
+    a single worker, which drains everything that arrives within BATCH_WINDOW,
+    groups it by model and decodes each group together in one llama.cpp context,
+    one sequence per request:
+      - the longest token prefix the group's prompts share (chat template, SC-CoT
+        instructions, feedback rubric) is evaluated once and copied to every sequence,
+      - the rest of every prompt goes into one multi-sequence batch,
+      - each generation step decodes the next token of all unfinished sequences
+        in a single forward pass, so the weights are read once per step instead
+        of once per sequence.
+    The shared prefix stays in the cache for the next group, and prefix= segments
+    are kept in LLAMA_CPP_PREFIX_SLOTS extra sequences, so the feedback rubric and
+    refinement instructions are evaluated once per model.
+    Sampling (temperature, top_k, top_p, min_p, seed) is done here per sequence,
+    with llama-cpp-python's defaults. score() runs in the same context, so the
+    weights are loaded once per model.
+    """
+    supports_scoring = True
+
+    def __init__(self, models=None, n_threads=LLAMA_CPP_THREADS, n_ctx=LLAMA_CPP_CTX,
+                 temperature=0.8, top_k=40, top_p=0.95, min_p=0.05,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, batch_ctx=LLAMA_CPP_BATCH_CTX):
+        try:
+            import llama_cpp
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+        except ImportError as e:
+            raise ImportError("The llamacpp backend needs llama-cpp-python: pip install 'llama-cpp-python>=0.3.16'") from e
+        self._llama_cpp = llama_cpp
+        self._formatter_cls = Jinja2ChatFormatter
+        self.model_paths = dict(models or LLAMA_CPP_MODELS)
+        self.n_threads = n_threads
+        self.n_ctx = n_ctx
+        self.batch_ctx = batch_ctx
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.min_p = min_p
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._models = {}
+        self._lock = threading.Lock()  # one context per model, shared by generation and scoring
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _load(self, model):
+        """
+        Loads the weights once per model and creates the context every request of
+        that model is decoded in: seq 0 holds the prefix shared with the previous
+        group, seqs 1..max_batch the requests and the rest the prefix slots.
+        """
+        if model not in self._models:
+            if model not in self.model_paths:
+                raise BackendError(f"No GGUF file configured for model '{model}'")
+            lib = self._llama_cpp
+            # Only the weights, tokenizer and chat template of this instance are used,
+            # so its own context is kept small
+            llm = lib.Llama(model_path=self.model_paths[model], n_ctx=LLAMA_CPP_N_BATCH, n_batch=LLAMA_CPP_N_BATCH,
+                            n_threads=self.n_threads, verbose=False)
+            params = lib.llama_context_default_params()
+            params.n_ctx = self.batch_ctx
+            params.n_batch = params.n_ubatch = LLAMA_CPP_N_BATCH
+            params.n_seq_max = 1 + self.max_batch + LLAMA_CPP_PREFIX_SLOTS
+            params.kv_unified = True  # sequences share cells, so copying a prefix to a sequence costs nothing
+            params.n_threads = llm.context_params.n_threads
+            params.n_threads_batch = llm.context_params.n_threads_batch
+            ctx = lib.llama_init_from_model(llm.model, params)
+            if not ctx:
+                raise BackendError(f"llama.cpp could not create a {self.batch_ctx}-token context for '{model}'")
+            template = llm.metadata.get("tokenizer.chat_template")
+            eos, bos = llm.token_eos(), llm.token_bos()
+            formatter = self._formatter_cls(
+                template=template,
+                eos_token=llm._model.token_get_text(eos) if eos != -1 else "",
+                bos_token=llm._model.token_get_text(bos) if bos != -1 else "",
+            ) if template else None
+            self._models[model] = {
+                "llm": llm,
+                "ctx": ctx,
+                "memory": lib.llama_get_memory(ctx),
+                "vocab": lib.llama_model_get_vocab(llm.model),
+                "batch": lib.llama_batch_init(LLAMA_CPP_N_BATCH, 0, 1),
+                "n_vocab": llm.n_vocab(),
+                "formatter": formatter,
+                "cached": [],    # tokens held by seq 0
+                "prefixes": {},  # prefix -> (seq id, tokens)
+            }
+        return self._models[model]
+
+    def _tokenize_chat(self, state, text):
+        # Same prompt as create_chat_completion: the GGUF's chat template around one user turn
+        if state["formatter"] is None:
+            return state["llm"].tokenize(text.encode("utf-8"), add_bos=True)
+        prompt = state["formatter"](messages=[{"role": "user", "content": text}]).prompt
+        return state["llm"].tokenize(prompt.encode("utf-8"), add_bos=False, special=True)
+
+    def _decode(self, state, entries):
+        """
+        Evaluates (seq_id, position, token, wants_logits) entries in forward passes of
+        up to LLAMA_CPP_N_BATCH tokens and returns the logits rows asked for, in order.
+        """
+        import numpy as np
+
+        lib, batch = self._llama_cpp, state["batch"]
+        rows = []
+        for start in range(0, len(entries), LLAMA_CPP_N_BATCH):
+            chunk = entries[start:start + LLAMA_CPP_N_BATCH]
+            for i, (seq, pos, token, wants_logits) in enumerate(chunk):
+                batch.token[i] = token
+                batch.pos[i] = pos
+                batch.n_seq_id[i] = 1
+                batch.seq_id[i][0] = seq
+                batch.logits[i] = wants_logits
+            batch.n_tokens = len(chunk)
+            status = lib.llama_decode(state["ctx"], batch)
+            if status != 0:
+                raise BackendError(f"llama_decode failed ({'KV cache full' if status == 1 else status})")
+            for i, (_, _, _, wants_logits) in enumerate(chunk):
+                if wants_logits:
+                    logits = lib.llama_get_logits_ith(state["ctx"], i)
+                    rows.append(np.ctypeslib.as_array(logits, shape=(state["n_vocab"],)).copy())
+        return rows
+
+    def _reset(self, state):
+        self._llama_cpp.llama_memory_clear(state["memory"], True)
+        state["cached"] = []
+        state["prefixes"] = {}
+
+    def _share_prefix(self, state, tokens, prefix=None):
+        """
+        Brings seq 0 to `tokens`, evaluating only what is not cached already (in seq 0
+        or in the slot of `prefix`). Returns the number of tokens evaluated.
+        """
+        lib, memory = self._llama_cpp, state["memory"]
+        kept = _common_prefix(state["cached"], tokens)
+        slot = state["prefixes"].get(prefix) if prefix else None
+        if slot and _common_prefix(slot[1], tokens) > kept:
+            kept = _common_prefix(slot[1], tokens)
+            lib.llama_memory_seq_rm(memory, 0, -1, -1)
+            lib.llama_memory_seq_cp(memory, slot[0], 0, 0, kept)
+        else:
+            lib.llama_memory_seq_rm(memory, 0, kept, -1)
+        self._decode(state, [(0, pos, tokens[pos], False) for pos in range(kept, len(tokens))])
+        state["cached"] = list(tokens)
+
+        if prefix and prefix not in state["prefixes"] and len(state["prefixes"]) < LLAMA_CPP_PREFIX_SLOTS:
+            # Keep the tokens the prefix alone produces (template start + prefix) in a slot of their own
+            length = _common_prefix(self._tokenize_chat(state, prefix), tokens)
+            seq = 1 + self.max_batch + len(state["prefixes"])
+            lib.llama_memory_seq_cp(memory, 0, seq, 0, length)
+            state["prefixes"][prefix] = (seq, tokens[:length])
+        return len(tokens) - kept
+
+    def _sample(self, logits, rng, options):
+        import numpy as np
+
+        temperature = options.get("temperature", self.temperature)
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        # Same order as llama-cpp-python's sampler chain: top-k, top-p, min-p, then temperature
+        top_k = options.get("top_k", self.top_k)
+        candidates = np.argpartition(logits, -top_k)[-top_k:] if 0 < top_k < len(logits) else np.arange(len(logits))
+        candidates = candidates[np.argsort(-logits[candidates])]
+        probs = np.exp(logits[candidates] - logits[candidates[0]])
+        probs /= probs.sum()
+        keep = max(1, int(np.searchsorted(np.cumsum(probs), options.get("top_p", self.top_p)) + 1))
+        keep = max(1, min(keep, int((probs >= options.get("min_p", self.min_p) * probs[0]).sum())))
+        candidates = candidates[:keep]
+        scaled = logits[candidates].astype(np.float64) / temperature
+        probs = np.exp(scaled - scaled.max())
+        return int(rng.choice(candidates, p=probs / probs.sum()))
+
+    def _generate_group(self, state, requests):
+        """
+        Decodes requests [(tokens, options, prefix)] together, one sequence each, and
+        returns one result dict per request (or the BackendError for that request).
+        """
+        import numpy as np
+
+        lib, memory, llm = self._llama_cpp, state["memory"], state["llm"]
+        start = time.perf_counter()
+        shared = min(len(tokens) for tokens, _, _ in requests) - 1
+        for tokens, _, _ in requests[1:]:
+            shared = min(shared, _common_prefix(requests[0][0], tokens))
+        prefix = requests[0][2] if all(p == requests[0][2] for _, _, p in requests) else None
+        evaluated = self._share_prefix(state, requests[0][0][:shared], prefix)
+
+        seqs = []
+        entries = []
+        for i, (tokens, options, _) in enumerate(requests):
+            seq = i + 1
+            lib.llama_memory_seq_rm(memory, seq, -1, -1)
+            lib.llama_memory_seq_cp(memory, 0, seq, 0, shared)
+            entries += [(seq, pos, tokens[pos], pos == len(tokens) - 1) for pos in range(shared, len(tokens))]
+            seqs.append({
+                "seq": seq,
+                "pos": len(tokens),
+                "options": options,
+                "rng": np.random.default_rng(options.get("seed")),
+                "max_tokens": self._max_tokens(options, len(tokens)),
+                "stop": options.get("stop") or [],
+                "generated": [],
+                "text": "",
+                "done": None,
+                "prompt_eval_tokens": len(tokens) - shared + (evaluated if i == 0 else 0),
+            })
+        # The last prompt token of every sequence is in `entries`, so the rows line up with seqs
+        logits = self._decode(state, entries)
+
+        active = seqs
+        while active:
+            step = []
+            for s, row in zip(active, logits):
+                token = self._sample(row, s["rng"], s["options"])
+                if lib.llama_vocab_is_eog(state["vocab"], token):
+                    s["done"] = time.perf_counter()
+                    continue
+                s["generated"].append(token)
+                s["text"] = llm.detokenize(s["generated"]).decode("utf-8", errors="ignore")
+                stops = [s["text"].index(stop) for stop in s["stop"] if stop in s["text"]]
+                if stops:
+                    s["text"] = s["text"][:min(stops)]
+                if stops or len(s["generated"]) >= s["max_tokens"]:
+                    s["done"] = time.perf_counter()
+                    continue
+                step.append(s)
+            active = step
+            logits = self._decode(state, [(s["seq"], s["pos"] + len(s["generated"]) - 1, s["generated"][-1], True) for s in active])
+
+        for s in seqs:
+            lib.llama_memory_seq_rm(memory, s["seq"], -1, -1)
+        return [{
+            "response": s["text"].strip(),
+            "prompt_tokens": len(tokens),
+            "prompt_eval_tokens": s["prompt_eval_tokens"],
+            "completion_tokens": len(s["generated"]),
+            "seconds": s["done"] - start,
+        } for s, (tokens, _, _) in zip(seqs, requests)]
+
+    def _max_tokens(self, options, prompt_tokens):
+        # num_predict as in Ollama (unset or <= 0: until the per-request context is full)
+        limit = self.n_ctx - prompt_tokens
+        num_predict = options.get("num_predict") or 0
+        return min(num_predict, limit) if num_predict > 0 else limit
+
+    def _cells_needed(self, request):
+        # KV cells a request can take at most; without num_predict that is the whole LLAMA_CPP_CTX
+        tokens, options, _ = request
+        return len(tokens) + self._max_tokens(options, len(tokens))
+
+    def _generate_now(self, model, requests):
+        """
+        Runs [(prompt, options, prefix)] for one model and returns a result dict or a
+        BackendError per request. Requests go into as few groups as the KV cells allow.
+        """
+        load_start = time.perf_counter()
+        with self._lock:
+            state = self._load(model)
+            load_seconds = time.perf_counter() - load_start
+            results = [None] * len(requests)
+            pending = []
+            for i, (prompt, options, prefix) in enumerate(requests):
+                tokens = self._tokenize_chat(state, (prefix or "") + prompt)
+                if len(tokens) >= self.n_ctx:
+                    results[i] = BackendError(f"Prompt of {len(tokens)} tokens does not fit the {self.n_ctx}-token context")
+                else:
+                    pending.append((i, (tokens, options or {}, prefix)))
+
+            reserved = sum(len(tokens) for _, tokens in state["prefixes"].values())
+            while pending:
+                group, cells = [], len(state["cached"]) + reserved
+                while pending and len(group) < self.max_batch and (not group or cells + self._cells_needed(pending[0][1]) <= self.batch_ctx):
+                    cells += self._cells_needed(pending[0][1])
+                    group.append(pending.pop(0))
+                try:
+                    outputs = self._generate_group(state, [request for _, request in group])
+                except BackendError as e:
+                    self._reset(state)
+                    outputs = [e] * len(group)
+                for (i, _), output in zip(group, outputs):
+                    if isinstance(output, dict):
+                        output["load_seconds"] = load_seconds
+                        output["seconds"] += load_seconds
+                    results[i] = output
+            return results
+
+    def score(self, model, context, continuations):
+        """
+        Returns the summed log-probability of each continuation given the context.
+        Runs in the generation context (no second copy of the model): the context is
+        evaluated once in seq 0 and each continuation only from where it differs.
+        """
+        import numpy as np
+
+        with self._lock:
+            state = self._load(model)
+            llm = state["llm"]
+            context_len = len(llm.tokenize(context.encode("utf-8"), add_bos=True))
+            scores = []
+            try:
+                for continuation in continuations:
+                    tokens = llm.tokenize((context + continuation).encode("utf-8"), add_bos=True)
+                    # logits at position i predict token i + 1, so decoding starts at start - 1
+                    start = max(1, min(context_len, len(tokens) - 1))
+                    self._share_prefix(state, tokens[:start - 1])
+                    logits = np.asarray(self._decode(state, [(0, pos, tokens[pos], True) for pos in range(start - 1, len(tokens) - 1)]), dtype=np.float64)
+                    state["cached"] = tokens[:-1]
+                    log_probs = logits - np.logaddexp.reduce(logits, axis=1, keepdims=True)
+                    targets = tokens[start:]
+                    scores.append(float(log_probs[np.arange(len(targets)), targets].sum()))
+            except BackendError:
+                self._reset(state)
+                raise
+            return scores
+
+    def _submit(self, model, prompt, options=None, prefix=None):
+        future = Future()
+        self._queue.put((model, prompt, options, prefix, future, time.perf_counter()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            # Group by model (avoids switching weights) and order by prompt so requests sharing a prefix share a group
+            batch.sort(key=lambda item: (item[0], item[3] or "", item[1]))
+            for model in dict.fromkeys(item[0] for item in batch):
+                items = [item for item in batch if item[0] == model]
+                picked_up = time.perf_counter()
+                try:
+                    results = self._generate_now(model, [(prompt, options, prefix) for _, prompt, options, prefix, _, _ in items])
+                except BackendError as e:
+                    results = [e] * len(items)
+                except Exception as e:
+                    error = BackendError(f"{type(e).__name__}: {e}")
+                    error.__cause__ = e
+                    results = [error] * len(items)
+                for (_, _, _, _, future, submitted), result in zip(items, results):
+                    if isinstance(result, BackendError):
+                        future.set_exception(result)
+                        continue
+                    result["queue_seconds"] = picked_up - submitted
+                    result["seconds"] += result["queue_seconds"]
+                    future.set_result(result)
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        return self._submit(model, prompt, options, prefix).result()
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def generate_batch(self, model, prompts, options=None):
+        # Submitted together, so the prompts are decoded in the same multi-sequence batch
+        futures = [self._submit(model, prompt, opts) for prompt, opts in zip(prompts, per_prompt(options, len(prompts)))]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BackendError as e:
+                results.append(e)
+        return results
+
+    def query_batch(self, model, prompts, options=None):
+        return batch_responses(self.generate_batch(model, prompts, options))
+
+class MockClient:
+    """
+    Stand-in for a model server, for checking runners and sweeps quickly and
+    without one. Answers are drawn from MOCK_ANSWER_MIX by hashing (model, prompt,
+    seed), so seeded and greedy requests are reproducible; unseeded requests vary
+    from call to call. Feedback prompts get a rubric score instead of an answer.
+    Nothing sleeps: token counts follow from the text and "seconds" is the time
+    the response would take at MOCK_TOKENS_PER_SECOND. Quantized tags such as
+    "llama3:8b-instruct-q4_0" use the mix of their base model, shifted a little
+    away from "they", and decode faster the fewer bits they use.
+    """
+    supports_scoring = True
+
+    def __init__(self, tokens_per_second=MOCK_TOKENS_PER_SECOND, consistency=MOCK_CONSISTENCY):
+        self.tokens_per_second = tokens_per_second
+        self.consistency = consistency
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _uniform(*parts):
+        digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2**64
+
+    def _profile(self, model):
+        base, _, tag = model.partition(":")
+        mix = dict(MOCK_ANSWER_MIX.get(base, MOCK_DEFAULT_MIX))
+        bits = re.search(r"q(\d)", tag)
+        speed = self.tokens_per_second
+        if bits:
+            bits = int(bits.group(1))
+            shift = min(mix["they"], 0.02 * (8 - bits))
+            mix["they"] -= shift
+            mix["he"] += shift
+            speed *= 8 / bits
+        return mix, speed
+
+    def _draw(self, mix, u):
+        for answer, p in mix.items():
+            if u < p:
+                return answer
+            u -= p
+        return answer
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        prompt = (prefix or "") + prompt
+        options = options or {}
+        if options.get("temperature") == 0:
+            draw = "greedy"
+        elif "seed" in options:
+            draw = options["seed"]
+        else:
+            with self._lock:
+                draw = self._calls[(model, prompt)] = self._calls.get((model, prompt), -1) + 1
+        mix, speed = self._profile(model)
+        usual = self._draw(mix, self._uniform(model, prompt, "usual"))
+        if draw != "greedy" and self._uniform(model, prompt, draw, "repeat") >= self.consistency:
+            usual = self._draw(mix, self._uniform(model, prompt, draw, "answer"))
+
+        if prompt.startswith("You will be given a question"):
+            score = 3 if self._uniform(model, prompt, draw, "score") < 0.5 else 2
+            response = f"The response is coherent and comprehensive. Total score: {score}/3"
+        else:
+            words = 6 if "step" not in prompt.lower() else 30 + int(90 * self._uniform(model, prompt, draw, "length"))
+            reasoning = " ".join(["reasoning"] * words)
+            response = reasoning if usual == "UNKNOWN" else f"{reasoning}\n\nMY FINAL ANSWER IS: {usual}."
+        if options.get("num_predict"):
+            response = apply_budget(response, options)
+
+        prompt_tokens = round(len(prompt.split()) * TOKENS_PER_WORD)
+        completion_tokens = round(len(response.split()) * TOKENS_PER_WORD)
+        return {
+            "response": response,
+            "prompt_tokens": prompt_tokens,
+            "prompt_eval_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            # prompt evaluation runs about ten times faster than decoding
+            "seconds": (prompt_tokens / 10 + completion_tokens) / speed
+        }
+
+    def query(self, model, prompt, options=None, prefix=None):
+        return self.generate(model, prompt, options, prefix)["response"]
+
+    def query_batch(self, model, prompts, options=None):
+        return [self.query(model, prompt, opts) for prompt, opts in zip(prompts, per_prompt(options, len(prompts)))]
+
+    def generate_batch(self, model, prompts, options=None):
+        return generate_each(self, model, prompts, options)
+
+    def score(self, model, context, continuations):
+        return [-10.0 - 10.0 * self._uniform(model, context, c) for c in continuations]
+
+class CachedClient:
+    """
+    Wraps a backend and serves deterministic requests (temperature 0) from a
+    shared in-memory cache keyed by (model, prompt, options). Concurrent
+    identical requests wait for the first one instead of querying again.
+    With seeded=True requests with a fixed seed are cached as well, for callers
+    such as sweep.py that repeat the same seeded samples across settings.
+    Everything else is passed straight through. Cache hits report 0 seconds and
+    keep the original request's time as "saved_seconds". A request that fails
+    (BackendError) is dropped from the cache, so the next identical one retries.
+    """
+    def __init__(self, client, seeded=False):
+        self.client = client
+        self.seeded = seeded
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def is_deterministic(self, options):
+        return bool(options) and (options.get("temperature") == 0 or (self.seeded and "seed" in options))
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        if not self.is_deterministic(options):
+            return self.client.generate(model, prompt, options, prefix)
+
+        key = (model, (prefix or "") + prompt, json.dumps(options, sort_keys=True))
+        with self._lock:
+            future = self._cache.get(key)
+            owner = future is None
+            if owner:
+                future = self._cache[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                future.set_result(self.client.generate(model, prompt, options, prefix))
+            except Exception as e:
+                with self._lock:
+                    del self._cache[key]
+                future.set_exception(e)
+            return future.result()
+        return self._served(future.result())
+
+    @staticmethod
+    def _served(result):
+        return dict(result, cached=True, seconds=0.0, saved_seconds=result["seconds"], prompt_eval_tokens=0)
+
+    def generate_batch(self, model, prompts, options=None):
+        """
+        Batch version of generate(): hits are served from the cache and every miss
+        (and non-deterministic prompt) goes to the backend in one generate_batch
+        call, so llamacpp still decodes them together. Failures (BackendError)
+        are returned in place and not cached.
+        """
+        per = per_prompt(options, len(prompts))
+        results = [None] * len(prompts)
+        sent, owned, waiting = [], {}, []
+        with self._lock:
+            for i, (prompt, opts) in enumerate(zip(prompts, per)):
+                if not self.is_deterministic(opts):
+                    sent.append(i)
+                    continue
+                key = (model, prompt, json.dumps(opts, sort_keys=True))
+                future = self._cache.get(key)
+                if future is None:
+                    future = self._cache[key] = Future()
+                    self.misses += 1
+                    owned[i] = key
+                    sent.append(i)
+                else:
+                    # Includes repeats of a prompt earlier in this batch
+                    self.hits += 1
+                    waiting.append((i, future))
+        try:
+            answers = self.client.generate_batch(model, [prompts[i] for i in sent], [per[i] for i in sent]) if sent else []
+        except Exception as e:
+            with self._lock:
+                for key in owned.values():
+                    self._cache.pop(key).set_exception(e)
+            raise
+        for i, result in zip(sent, answers):
+            results[i] = result
+            if i in owned:
+                failed = isinstance(result, BackendError)
+                with self._lock:
+                    future = self._cache.pop(owned[i]) if failed else self._cache[owned[i]]
+                if failed:
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        for i, future in waiting:
+            try:
+                results[i] = self._served(future.result())
+            except BackendError as e:
+                results[i] = e
+        return results
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def query_batch(self, model, prompts, options=None):
+        per = per_prompt(options, len(prompts))
+        if not any(self.is_deterministic(opts) for opts in per):
+            return self.client.query_batch(model, prompts, options)
+        return batch_responses(self.generate_batch(model, prompts, per))
+
+    @property
+    def supports_scoring(self):
+        return self.client.supports_scoring
+
+    def score(self, model, context, continuations):
+        return self.client.score(model, context, continuations)
+
+class ReplayClient:
+    """
+    Serves responses recorded in earlier runs instead of querying a model.
+
+    Indexes raw-log JSONL files ({"model", "prompt", "response", ...} per line,
+    as written by wino-z-cot-sc.py and RecordingClient) and the self-correction
+    and adaptive-consistency result JSON files by (model, prompt). Prompts recorded
+    several times (one per repetition) are served round-robin, or picked by the
+    seed when one is given. A generation budget in the options is applied to the
+    recorded response.
+
+    on_miss decides what happens to prompts that were never recorded:
+      "error"    raise ReplayMiss (a KeyError)
+      "unknown"  return an "ERROR: ..." response, which the runners parse as UNKNOWN;
+                 the result is marked "replayed": False so callers can count them
+      "fallback" query fallback_backend (recording the new responses to record_misses, if set)
+    """
+    supports_scoring = False  # recorded logs contain no log-probabilities
+
+    def __init__(self, paths=None, on_miss="error", fallback_backend="ollama", record_misses=None):
+        if on_miss not in ("error", "unknown", "fallback"):
+            raise ValueError(f"Unknown miss policy '{on_miss}'")
+        self.on_miss = on_miss
+        self.index = {}
+        self.hits = 0
+        self.misses = 0
+        self._cursor = {}
+        self._lock = threading.Lock()
+        for pattern in paths or REPLAY_LOGS:
+            for path in sorted(glob.glob(pattern)):
+                self.load(path)
+        self.fallback = None
+        if on_miss == "fallback":
+            self.fallback = get_client(fallback_backend)
+            if record_misses:
+                self.fallback = RecordingClient(self.fallback, record_misses)
+
+    def add(self, model, prompt, response):
+        self.index.setdefault((model, prompt), []).append(response)
+
+    def load(self, path):
+        if path.endswith(".jsonl"):
+            for entry in iter_jsonl(path):
+                self.add(entry["model"], entry["prompt"], entry["response"])
+            return
+        for sentence, result in iter_json_object(path):
+            if "responder" in result:
+                self._add_self_correction(sentence, result)
+            else:
+                self._add_adaptive_consistency(sentence, result)
+
+    def _add_self_correction(self, sentence, result):
+        # These files keep responses but not prompts, so rebuild the prompts the runner sent:
+        # the initial prompt always, and the feedback prompt when the chain ended on a perfect
+        # score (then the final feedback was given on the final response). Refinement prompts
+        # and the other feedback prompts cannot be rebuilt and are misses.
+        from winogender import build_initial_prompt, build_feedback_prompt, is_perfect_score
+
+        self.add(result["responder"], build_initial_prompt(sentence), result["initial_response"])
+        if result.get("final_feedback") and is_perfect_score(result["final_feedback"]):
+            prompt = build_feedback_prompt(sentence, result["final_response"])
+            self.add(result["feedbacker"], prompt, result["final_feedback"])
+
+    def _add_adaptive_consistency(self, sentence, result):
+        # wino-ac.py keeps only the parsed answer of each sample, so every sample is served
+        # as a bare final answer (an UNKNOWN sample as a response without one)
+        from winogender import build_ac_prompt
+
+        for model, prediction in result.items():
+            samples = prediction.get("samples") if isinstance(prediction, dict) else None
+            if not isinstance(samples, list):  # e.g. the pooled summary of --pooled runs
+                continue
+            for pred in samples:
+                response = "No answer." if pred == "UNKNOWN" else f"MY FINAL ANSWER IS: {pred}."
+                self.add(model, build_ac_prompt(sentence), response)
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        start = time.perf_counter()
+        key = (model, (prefix or "") + prompt)
+        responses = self.index.get(key)
+        if not responses:
+            with self._lock:
+                self.misses += 1
+            if self.on_miss == "error":
+                raise ReplayMiss(f"No recorded response for {model} and this prompt; record the run on a live backend "
+                                 f"first (get_client(record_path=...), wino-ac.py --record) or replay with "
+                                 f"on_miss='fallback' or 'unknown'")
+            if self.on_miss == "fallback":
+                result = self.fallback.generate(model, prompt, options, prefix)
+                with self._lock:
+                    self.add(model, key[1], result["response"])
+                return result
+            response = "ERROR: no recorded response"
+        else:
+            with self._lock:
+                self.hits += 1
+                if options and "seed" in options:
+                    pick = options["seed"] % len(responses)
+                else:
+                    pick = self._cursor.get(key, 0)
+                    self._cursor[key] = (pick + 1) % len(responses)
+            # Recorded responses were unbudgeted, so cut them to what a budget would have allowed
+            response = apply_budget(responses[pick], options)
+        return {
+            "response": response,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "seconds": time.perf_counter() - start,
+            "replayed": bool(responses)
+        }
+
+    def query(self, model, prompt, options=None, prefix=None):
+        return self.generate(model, prompt, options, prefix)["response"]
+
+    def query_batch(self, model, prompts, options=None):
+        return [self.query(model, prompt, opts) for prompt, opts in zip(prompts, per_prompt(options, len(prompts)))]
+
+    def generate_batch(self, model, prompts, options=None):
+        return generate_each(self, model, prompts, options)
+
+class RecordingClient:
+    """
+    Wraps a backend and appends every response to a JSONL file in the raw-log
+    format ({"model", "prompt", "response"}, plus the options used), so a live
+    run can be replayed later with ReplayClient. Failed requests are not recorded.
+    """
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, model, prompt, options, result):
+        entry = {"model": model, "prompt": prompt, "response": result["response"]}
+        if options:
+            entry["options"] = options
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        result = self.client.generate(model, prompt, options, prefix)
+        self._record(model, (prefix or "") + prompt, options, result)
+        return result
+
+    def generate_batch(self, model, prompts, options=None):
+        per = per_prompt(options, len(prompts))
+        results = self.client.generate_batch(model, prompts, per)
+        for prompt, opts, result in zip(prompts, per, results):
+            if not isinstance(result, BackendError):
+                self._record(model, prompt, opts, result)
+        return results
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def query_batch(self, model, prompts, options=None):
+        return batch_responses(self.generate_batch(model, prompts, options))
+
+    @property
+    def supports_scoring(self):
+        return self.client.supports_scoring
+
+    def score(self, model, context, continuations):
+        return self.client.score(model, context, continuations)
+
+BACKENDS = {
+    "ollama": OllamaClient,
+    "ollama-http": OllamaHTTPClient,
+    "llamacpp": LlamaCppClient,
+    "replay": ReplayClient,
+    "mock": MockClient,
+}
+# Backends that answer without a model, so there is nothing to load or pace
+OFFLINE_BACKENDS = ("replay", "mock")
+
+def get_client(backend="ollama", cache=False, record_path=None, **kwargs):
+    """
+    Builds a backend by name. cache=True wraps it in the shared response cache;
+    record_path additionally logs every response for later replay.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}' (choose from {', '.join(BACKENDS)})")
+    client = BACKENDS[backend](**kwargs)
+    if record_path:
+        client = RecordingClient(client, record_path)
+    return CachedClient(client) if cache else client
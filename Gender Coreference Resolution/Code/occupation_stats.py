@@ -0,0 +1,225 @@
+import argparse
+import csv
+import json
+import time
+import warnings
+from collections import Counter
+import numpy as np
+from batch_analysis import RESULTS_ROOT, find_result_files, predictions, read_entries
+from winogender import categorize_pronoun
+
+# Correlates each model's gendered predictions per occupation with the share of women in that
+# occupation (BLS 2015 labour statistics and Bergsma's text statistics), per model and strategy.
+OCCUPATION_STATS_FILE = "../Data/Winogender Schemas/data/occupations-stats.tsv"
+TEMPLATES_FILE = "../Data/Winogender Schemas/data/templates.tsv"
+OUTPUT_FILE = "Results/occupation_correlations.json"
+BOOTSTRAP_SAMPLES = 2000
+BOOTSTRAP_SEED = 0
+CI = 0.95
+CATEGORIES = ["neutral", "male", "female", "unknown"]
+PRONOUN_SLOTS = ["$NOM_PRONOUN", "$POSS_PRONOUN", "$ACC_PRONOUN"]
+
+def load_occupation_stats(path=OCCUPATION_STATS_FILE):
+    # Row order gives the integer occupation codes
+    with open(path, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    names = [row["occupation"] for row in rows]
+    bls = np.array([float(row["bls_pct_female"]) for row in rows])
+    bergsma = np.array([float(row["bergsma_pct_female"]) for row in rows])
+    return names, bls, bergsma
+
+def sentence_codes(names, path=TEMPLATES_FILE):
+    """
+    Maps every prepared sentence to its occupation code by rendering the Winogender
+    templates the same way prepared_sentences.txt was made (pronoun slot -> ___),
+    instead of guessing the occupation from the words after "The".
+    """
+    code = {name: i for i, name in enumerate(names)}
+    codes = {}
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)
+        for occupation, participant, _, template in reader:
+            sentence = template.replace("$OCCUPATION", occupation).replace("$PARTICIPANT", participant)
+            for slot in PRONOUN_SLOTS:
+                sentence = sentence.replace(slot, "___")
+            codes[sentence] = code[occupation]
+    return codes
+
+def encode_results(paths, codes):
+    """
+    Streams every prediction in the result files and counts it under its integer
+    codes (run, model, strategy, occupation, category); each file counts as one run.
+    Memory is bounded by the number of distinct codes, not by the number of sentences.
+    Returns the codes as parallel arrays with their counts, and the model / strategy
+    names behind the codes.
+    """
+    models, strategies = {}, {}
+    tally = Counter()
+    runs = 0
+    for path in paths:
+        fmt, entries = read_entries(path)
+        if fmt is None:
+            continue
+        for sentence, model, strategy, prediction in predictions(entries, fmt):
+            if sentence not in codes:
+                continue
+            tally[(runs, models.setdefault(model, len(models)), strategies.setdefault(strategy, len(strategies)),
+                   codes[sentence], CATEGORIES.index(categorize_pronoun(prediction)))] += 1
+        runs += 1
+    keys = np.array(list(tally), dtype=np.int32).reshape(-1, 5)
+    arrays = [keys[:, i] for i in range(5)]
+    weights = np.array(list(tally.values()), dtype=np.int64)
+    return arrays, weights, list(models), list(strategies), runs
+
+def count_tensor(arrays, weights, shape):
+    # counts[run, model, strategy, occupation, category] with a single bincount
+    flat = np.ravel_multi_index(tuple(arrays), shape)
+    return np.bincount(flat, weights=weights, minlength=int(np.prod(shape))).reshape(shape)
+
+def weighted_fit(x, y, w):
+    """
+    Weighted Pearson r and least-squares slope of y on x over the last axis, for
+    any leading batch shape of y and w. x is the occupation statistic, so every
+    sum involving it is a matrix-vector product.
+    """
+    wy = w * y
+    sw, swy, swyy = w.sum(-1), wy.sum(-1), (wy * y).sum(-1)
+    swx, swxx, swxy = w @ x, w @ (x * x), wy @ x
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sxy = swxy - swx * swy / sw
+        sxx = swxx - swx * swx / sw
+        syy = swyy - swy * swy / sw
+        return sxy / np.sqrt(sxx * syy), sxy / sxx
+
+def female_share(counts):
+    # % female among the gendered (he/she) predictions per occupation, and whether it is defined;
+    # counts ends in the (male, female) categories
+    male, female = counts[..., 0], counts[..., 1]
+    gendered = male + female
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(gendered > 0, 100.0 * female / gendered, 0.0)
+    return share, (gendered > 0).astype(float)
+
+def run_weights(present, samples, rng):
+    """
+    Bootstrap weights over the runs, stratified per (model, strategy): every replicate
+    draws as many runs as contain that model and strategy, from those runs only.
+    present has shape (runs, models, strategies); returns (samples, runs, models, strategies).
+    """
+    weights = np.zeros((samples,) + present.shape)
+    for m, s in zip(*np.nonzero(present.any(0))):
+        runs = np.flatnonzero(present[:, m, s])
+        weights[:, runs, m, s] = rng.multinomial(len(runs), np.full(len(runs), 1 / len(runs)), size=samples)
+    return weights
+
+def correlations(counts, stats, samples=BOOTSTRAP_SAMPLES, seed=BOOTSTRAP_SEED, ci=CI):
+    """
+    counts has shape (runs, models, strategies, occupations, categories).
+    Returns r and slope per model and strategy for each statistic, with bootstrap
+    CIs that resample the runs containing that model and strategy and the occupations
+    with replacement. Replicates where r or the slope is undefined (fewer than two
+    occupations with gendered predictions, or no spread) are left out of the CI and
+    counted in "valid".
+    """
+    runs, models, strategies, occupations, _ = counts.shape
+    gendered = counts[..., 1:3].astype(float)
+    present = counts.sum((-2, -1)) > 0
+    rng = np.random.default_rng(seed)
+
+    share, defined = female_share(gendered.sum(0))
+    # Bootstrap weights: how often each run / occupation is drawn in each replicate.
+    # Resampling the runs is one (samples x runs) @ (runs x occupations) product per model and strategy.
+    per_pair = gendered.transpose(1, 2, 0, 3, 4).reshape(models, strategies, runs, -1)
+    boot_counts = run_weights(present, samples, rng).transpose(2, 3, 0, 1) @ per_pair
+    boot_counts = boot_counts.reshape(models, strategies, samples, occupations, 2).transpose(2, 0, 1, 3, 4)
+    occ_weights = rng.multinomial(occupations, np.full(occupations, 1 / occupations), size=samples).astype(float)
+    boot_share, boot_defined = female_share(boot_counts)
+    boot_weights = boot_defined * occ_weights[:, None, None, :]
+
+    lo, hi = (1 - ci) / 2 * 100, (1 + ci) / 2 * 100
+    results = {}
+    for name, x in stats.items():
+        r, slope = weighted_fit(x, share, defined)
+        boot_r, boot_slope = weighted_fit(x, boot_share, boot_weights)
+        valid = np.isfinite(boot_r) & np.isfinite(boot_slope)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN slices give a NaN CI
+            results[name] = {
+                "r": r,
+                "slope": slope,
+                "r_ci": np.nanpercentile(np.where(valid, boot_r, np.nan), [lo, hi], axis=0),
+                "slope_ci": np.nanpercentile(np.where(valid, boot_slope, np.nan), [lo, hi], axis=0),
+                "valid": valid.sum(0),
+            }
+    return results, defined.sum(-1), present.sum(0)
+
+def report(results, occupations_used, runs_used, models, strategies):
+    rows = []
+    for m, model in enumerate(models):
+        for s, strategy in enumerate(strategies):
+            if not occupations_used[m, s]:
+                continue
+            row = {"model": model, "strategy": strategy, "runs": int(runs_used[m, s]),
+                   "occupations": int(occupations_used[m, s])}
+            for name, res in results.items():
+                row[name] = {
+                    "r": round(float(res["r"][m, s]), 4),
+                    "r_ci": [round(float(v), 4) for v in res["r_ci"][:, m, s]],
+                    "slope": round(float(res["slope"][m, s]), 4),
+                    "slope_ci": [round(float(v), 4) for v in res["slope_ci"][:, m, s]],
+                    "valid_replicates": int(res["valid"][m, s]),
+                }
+            rows.append(row)
+    return rows
+
+def print_rows(rows, stats, samples):
+    header = f"{'model':<10} {'strategy':<28} {'runs':>4} {'occ':>4}"
+    for name in stats:
+        header += f" {'r ' + name:>22} {'slope ' + name:>22}"
+    print(header)
+    for row in rows:
+        line = f"{row['model']:<10} {row['strategy']:<28} {row['runs']:>4} {row['occupations']:>4}"
+        for name in stats:
+            res = row[name]
+            line += (f" {res['r']:>6.2f} [{res['r_ci'][0]:>5.2f},{res['r_ci'][1]:>5.2f}]"
+                     f" {res['slope']:>6.2f} [{res['slope_ci'][0]:>5.2f},{res['slope_ci'][1]:>5.2f}]")
+        valid = min(row[name]["valid_replicates"] for name in stats)
+        if valid < samples:
+            line += f"  (CI from {valid} of {samples} replicates)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Correlate per-occupation predictions with BLS and Bergsma female percentages")
+    parser.add_argument("--root", default=RESULTS_ROOT)
+    parser.add_argument("--samples", type=int, default=BOOTSTRAP_SAMPLES)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--tile", type=int, default=1,
+                        help="repeat the corpus N times as extra runs, to time the analysis on a large multi-run corpus")
+    args = parser.parse_args()
+
+    names, bls, bergsma = load_occupation_stats()
+    stats = {"bls": bls, "bergsma": bergsma}
+    start = time.perf_counter()
+    arrays, weights, models, strategies, runs = encode_results(find_result_files(args.root), sentence_codes(names))
+    if args.tile > 1:
+        arrays = [np.tile(a, args.tile) for a in arrays]
+        arrays[0] = arrays[0] + np.repeat(np.arange(args.tile) * runs, len(weights))
+        weights = np.tile(weights, args.tile)
+        runs *= args.tile
+    encoded = time.perf_counter()
+
+    counts = count_tensor(arrays, weights, (runs, len(models), len(strategies), len(names), len(CATEGORIES)))
+    results, occupations_used, runs_used = correlations(counts, stats, args.samples)
+    computed = time.perf_counter()
+
+    rows = report(results, occupations_used, runs_used, models, strategies)
+    print_rows(rows, stats, args.samples)
+    print(f"\n{int(weights.sum())} predictions from {runs} runs: encoded in {(encoded - start) * 1000:.0f} ms, "
+          f"counts + {args.samples} bootstrap replicates in {(computed - encoded) * 1000:.0f} ms")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"bootstrap_samples": args.samples, "ci": CI, "rows": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
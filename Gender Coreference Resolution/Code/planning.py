@@ -0,0 +1,34 @@
+import hashlib
+from inference import CachedClient
+
+def item_id(sentence):
+    # Stable across runs, input order and machines: derived from the (whitespace-normalised) text only
+    text = " ".join(sentence.split())
+    return "wg-" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+def load_items(path):
+    """
+    Reads the Winogender sentences as (item_id, sentence) pairs, keeping the first
+    occurrence of each sentence. Duplicate lines would otherwise be queried again
+    and overwrite each other in the sentence-keyed result files.
+    """
+    items = {}
+    total = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if "___" in line:
+                total += 1
+                sentence = line.strip()
+                items.setdefault(item_id(sentence), sentence)
+    print(f"Planning: {len(items)} items, {total - len(items)} duplicate sentences dropped")
+    return list(items.items())
+
+def report_collapsed(client):
+    """
+    Prints how many requests were answered from an identical earlier one by the
+    shared response cache (inference.CachedClient); a client without it collapses none.
+    """
+    if isinstance(client, CachedClient):
+        print(f"Planning: {client.hits} identical requests collapsed")
+    else:
+        print("Planning: 0 identical requests collapsed")
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import json
+from collections import defaultdict
+from inference import GENERATION_PROFILES, TOKENS_PER_WORD, apply_budget, generation_options, get_client
+from planning import load_items
+from streaming import iter_json_object, iter_jsonl
+from winogender import build_prompts, extract_pronoun, parse_total_score
+
+# Compares every strategy with and without its generation profile (inference.GENERATION_PROFILES):
+# latency saved against the change in UNKNOWN answers (unparseable scores for feedback).
+#   python profile_report.py                             replays the recorded responses in Results/
+#   python profile_report.py --backend ollama-http       queries a live backend both ways
+RAW_LOGS = "Results/Zero-shot, CoT, SC-CoT/*.jsonl"
+SELF_CORRECTION_LOGS = "Results/Self Correction/correction_*.json"
+INPUT_FILE = "../Data/Winogender Schemas/data/prepared_sentences.txt"
+OUTPUT_FILE = "generation_profile_report.json"
+DECODE_TOKENS_PER_SECOND = 15.0  # CPU decode rate of a 7-8B Q4 model, for the replayed estimate
+LIVE_LIMIT = 10                  # sentences per strategy in live mode
+LIVE_MODELS = ["llama3", "mistral"]
+LIVE_STRATEGIES = ["zero_shot", "cot", "cot_sc"]
+
+def estimate_tokens(text):
+    return len(text.split(" ")) * TOKENS_PER_WORD if text else 0.0
+
+def outcome(strategy, text):
+    # What the downstream code reads from a response: a pronoun, or a score for feedback
+    if strategy == "feedback":
+        return "UNKNOWN" if parse_total_score(text) is None else parse_total_score(text)[0]
+    return extract_pronoun(text)
+
+def recorded_responses():
+    # Yields (strategy, response) for every recorded response a profile applies to
+    for path in sorted(glob.glob(RAW_LOGS)):
+        for entry in iter_jsonl(path):
+            yield ("cot_sc" if entry["mode"].startswith("cot_sc") else entry["mode"]), entry["response"]
+    for path in sorted(glob.glob(SELF_CORRECTION_LOGS)):
+        for _, result in iter_json_object(path):
+            yield "cot", result["initial_response"]  # the initial self-correction prompt uses the cot profile
+            if result.get("final_feedback"):
+                yield "feedback", result["final_feedback"]
+            if result.get("final_response") and result["final_response"] != result["initial_response"]:
+                yield "refine", result["final_response"]
+
+def new_row():
+    return {"n": 0, "tokens": 0.0, "budget_tokens": 0.0, "seconds": 0.0, "budget_seconds": 0.0,
+            "unknown": 0, "budget_unknown": 0, "changed": 0}
+
+def add(row, strategy, full, budgeted, seconds=None, budget_seconds=None, tokens=None, budget_tokens=None):
+    before, after = outcome(strategy, full), outcome(strategy, budgeted)
+    row["n"] += 1
+    row["tokens"] += tokens if tokens is not None else estimate_tokens(full)
+    row["budget_tokens"] += budget_tokens if budget_tokens is not None else estimate_tokens(budgeted)
+    row["seconds"] += seconds or 0.0
+    row["budget_seconds"] += budget_seconds or 0.0
+    row["unknown"] += before == "UNKNOWN"
+    row["budget_unknown"] += after == "UNKNOWN"
+    row["changed"] += before != after
+
+def replay_report(tokens_per_second):
+    rows = defaultdict(new_row)
+    for strategy, response in recorded_responses():
+        add(rows[strategy], strategy, response, apply_budget(response, GENERATION_PROFILES.get(strategy)))
+    for row in rows.values():
+        row["seconds"] = row["tokens"] / tokens_per_second
+        row["budget_seconds"] = row["budget_tokens"] / tokens_per_second
+    return rows
+
+def live_report(backend, limit):
+    """
+    Runs the first `limit` sentences through each strategy twice, greedily so the
+    only difference is the budget. Uses the backend's token counts and timings.
+    """
+    client = get_client(backend)
+    sentences = [sentence for _, sentence in load_items(INPUT_FILE)][:limit]
+    rows = defaultdict(new_row)
+    for strategy in LIVE_STRATEGIES:
+        for model in LIVE_MODELS:
+            for sentence in sentences:
+                prompt = build_prompts(sentence, 1)[strategy]
+                prompt = prompt[0] if isinstance(prompt, list) else prompt
+                full = client.generate(model, prompt, {"temperature": 0})
+                budgeted = client.generate(model, prompt, generation_options(strategy, {"temperature": 0}))
+                add(rows[strategy], strategy, full["response"], budgeted["response"],
+                    full["seconds"], budgeted["seconds"], full.get("completion_tokens"), budgeted.get("completion_tokens"))
+        print(f"  {strategy}: done")
+    return rows
+
+def print_report(rows, source):
+    print(f"\n=== Generation profiles ({source}) ===")
+    print(f"{'strategy':<10} {'n':>6} {'tokens/resp':>16} {'seconds':>18} {'saved':>7} {'UNKNOWN rate':>15} {'changed':>8}")
+    for strategy, row in sorted(rows.items()):
+        n = row["n"] or 1
+        saved = 1 - row["budget_seconds"] / row["seconds"] if row["seconds"] else 0.0
+        print(f"{strategy:<10} {row['n']:>6} {row['tokens'] / n:>7.0f} -> {row['budget_tokens'] / n:>5.0f} "
+              f"{row['seconds']:>8.0f} -> {row['budget_seconds']:>6.0f} {saved:>7.1%} "
+              f"{row['unknown'] / n:>6.1%} -> {row['budget_unknown'] / n:>5.1%} {row['changed']:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency saved by the generation profiles against the change in UNKNOWN answers")
+    parser.add_argument("--backend", help="query this backend live instead of replaying the recorded responses")
+    parser.add_argument("--limit", type=int, default=LIVE_LIMIT)
+    parser.add_argument("--tokens-per-second", type=float, default=DECODE_TOKENS_PER_SECOND,
+                        help="decode rate used to turn replayed token savings into seconds")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    if args.backend == "ollama":
+        parser.error("--backend needs a backend that takes sampling options (ollama-http or llamacpp)")
+    if args.backend:
+        rows = live_report(args.backend, args.limit)
+        source = f"live, {args.backend}, {args.limit} sentences"
+    else:
+        rows = replay_report(args.tokens_per_second)
+        source = f"recorded responses, estimated at {args.tokens_per_second:g} tok/s"
+    print_report(rows, source)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "profiles": GENERATION_PROFILES, "strategies": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
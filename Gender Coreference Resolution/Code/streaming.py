@@ -0,0 +1,91 @@
+import json
+import re
+
+# Readers that hand result files over one entry at a time, so memory is bounded by the
+# largest single entry instead of the whole file. Results are written either as JSONL
+# (raw logs) or as one big JSON object keyed by sentence (the legacy nested format).
+CHUNK_SIZE = 1 << 16
+_WHITESPACE = re.compile(r"\s*")
+_AFTER_VALUE = set(" \t\r\n,:}]")
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class _ObjectReader:
+    """
+    Incremental parser for a top-level JSON object: keeps a text buffer that is
+    refilled from the file on demand and decodes one key / value at a time with
+    JSONDecoder.raw_decode. Values that straddle the buffer end grow it by doubling.
+    """
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return
+            self.fill()
+
+    def next_char(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buf):
+            raise ValueError("Unexpected end of JSON input")
+        char = self.buf[self.pos]
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            # A complete value is followed by whitespace or punctuation; anything else (or the end
+            # of the buffer) means a number was cut off by the chunk boundary, e.g. "0." + "25"
+            if not self.eof and (end == len(self.buf) or self.buf[end] not in _AFTER_VALUE):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+def iter_json_object(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields the (key, value) pairs of the top-level JSON object in path one at a
+    time, in file order, without loading the whole file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _ObjectReader(f, chunk_size)
+        if reader.next_char() != "{":
+            raise ValueError(f"{path} does not hold a JSON object")
+        reader.skip_whitespace()
+        if reader.buf[reader.pos:reader.pos + 1] == "}":
+            return
+        while True:
+            key = reader.value()
+            if reader.next_char() != ":":
+                raise ValueError(f"Expected ':' after key {key!r} in {path}")
+            yield key, reader.value()
+            separator = reader.next_char()
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' after the value of {key!r} in {path}")
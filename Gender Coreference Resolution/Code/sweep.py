@@ -0,0 +1,288 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from inference import OFFLINE_BACKENDS, TOKENS_PER_WORD, BackendError, CachedClient, batch_responses, get_client
+from planning import load_items
+from streaming import iter_json_object
+from tracing import Tracer
+from winogender import categorize_pronoun
+
+# Runs the strategy runners over a grid of model tags (quantized variants included, e.g.
+# "llama3:8b-instruct-q4_0") and strategy settings, and reports the Pareto frontier of neutral
+# accuracy and bias against queries, tokens and time. All settings share one response cache
+# (greedy and seeded samples are identical across settings) and run grouped by model, so a
+# model is loaded once. --backend mock checks a grid in seconds without a model server.
+INPUT_FILE = "../Data/Winogender Schemas/data/prepared_sentences.txt"
+OUTPUT_FILE = "sweep_results.json"
+BACKEND = "ollama-http"
+CONCURRENCY = 4  # sentences in flight per setting
+SWEEP_GRID = {
+    "models": ["llama3", "mistral"],
+    "strategies": {
+        "zero_shot": {},
+        "cot": {},
+        "cot_sc": {"sc_samples": [5, 10], "sc_early_exit": [False, True]},
+        "ac": {"max_samples": [5, 10, 20], "stop_prob": [0.9, 0.95, 0.99], "stop_rule": ["legacy", "dirichlet"]},
+        "self_corr": {"max_attempts": [1, 3, 10]},
+    },
+}
+RUNNERS = {
+    "zero_shot": "wino-z-cot-sc.py",
+    "cot": "wino-z-cot-sc.py",
+    "cot_sc": "wino-z-cot-sc.py",
+    "ac": "wino-ac.py",
+    "self_corr": "wino_self_corr.py",
+}
+# Grid parameter -> the runner constant it sets ("feedbacker" picks the self-correction feedback model)
+PARAMETERS = {
+    "cot_sc": {"sc_samples": "SC_NUM_SAMPLES", "sc_early_exit": "SC_EARLY_EXIT", "sc_stop_prob": "SC_STOP_PROB"},
+    "ac": {"max_samples": "MAX_SAMPLES", "stop_prob": "STOP_PROB", "stop_rule": "AC_STOP_RULE"},
+    "self_corr": {"max_attempts": "MAX_ATTEMPTS", "stable_rounds": "STABLE_ROUNDS", "feedbacker": None},
+}
+COSTS = ["queries", "tokens", "seconds"]
+
+def load_runner(filename):
+    # The runners are scripts (some with hyphenated names), so load them from their files
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class MeteredClient:
+    """
+    Counts the queries, tokens and seconds of one setting. It sits above the shared
+    cache, so a setting is charged what it would cost on its own, including the
+    requests another setting already made. With the replay backend it also counts
+    the prompts that had no recorded response (answered as UNKNOWN).
+    """
+    def __init__(self, client):
+        self.client = client
+        self.queries = 0
+        self.replay_misses = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _charge(self, prompt, result):
+        prompt_tokens = result.get("prompt_tokens") or round(len(prompt.split()) * TOKENS_PER_WORD)
+        completion_tokens = result.get("completion_tokens") or round(len(result["response"].split()) * TOKENS_PER_WORD)
+        with self._lock:
+            self.queries += 1
+            self.tokens += prompt_tokens + completion_tokens
+            self.seconds += result.get("saved_seconds", result["seconds"])
+            self.replay_misses += result.get("replayed") is False
+
+    def generate(self, model, prompt, options=None, prefix=None):
+        result = self.client.generate(model, prompt, options, prefix)
+        self._charge((prefix or "") + prompt, result)
+        return result
+
+    def generate_batch(self, model, prompts, options=None):
+        results = self.client.generate_batch(model, prompts, options)
+        for prompt, result in zip(prompts, results):
+            if not isinstance(result, BackendError):
+                self._charge(prompt, result)
+        return results
+
+    def query(self, model, prompt, options=None, prefix=None):
+        try:
+            return self.generate(model, prompt, options, prefix)["response"]
+        except BackendError as e:
+            return f"ERROR: {e}"
+
+    def query_batch(self, model, prompts, options=None):
+        return batch_responses(self.generate_batch(model, prompts, options))
+
+    @property
+    def supports_scoring(self):
+        return self.client.supports_scoring
+
+    def score(self, model, context, continuations):
+        with self._lock:
+            self.queries += 1
+        return self.client.score(model, context, continuations)
+
+def expand_grid(grid):
+    settings = []
+    for model in grid["models"]:
+        for strategy, params in grid["strategies"].items():
+            if strategy not in RUNNERS:
+                raise ValueError(f"Unknown strategy '{strategy}' (choose from {', '.join(RUNNERS)})")
+            unknown = set(params) - set(PARAMETERS.get(strategy, {}))
+            if unknown:
+                raise ValueError(f"{strategy} has no parameter(s) {', '.join(sorted(unknown))}")
+            names = list(params)
+            for values in itertools.product(*(params[n] for n in names)):
+                settings.append({"model": model, "strategy": strategy, "params": dict(zip(names, values))})
+    return settings
+
+def schedule(settings):
+    """
+    Orders the settings so each model's settings run back to back (one model load
+    each) and, within a strategy, the most expensive settings run first: their
+    seeded samples are a superset of the cheaper settings', which then come from the cache.
+    """
+    models = list(dict.fromkeys(s["model"] for s in settings))
+    strategies = list(RUNNERS)
+    def key(s):
+        size = sum(v for v in s["params"].values() if isinstance(v, (int, float)))
+        return models.index(s["model"]), strategies.index(s["strategy"]), -size
+    return sorted(settings, key=key)
+
+def configure(runner, setting, client, defaults, workdir):
+    # Every setting starts from the runner's own constants and overrides its grid parameters
+    for name, value in defaults.items():
+        setattr(runner, name, value)
+    for param, value in setting["params"].items():
+        constant = PARAMETERS[setting["strategy"]][param]
+        if constant:
+            setattr(runner, constant, value)
+    runner.CLIENT = client
+    if setting["strategy"] in ("zero_shot", "cot", "cot_sc"):
+        runner.STRATEGIES = [setting["strategy"]]
+        runner.RAW_LOG_FILE = os.path.join(workdir, "raw_llm_responses.jsonl")
+    elif setting["strategy"] == "self_corr":
+        runner.RUN = 0
+        runner.TRACER = Tracer(os.path.join(workdir, "self_correction_trace.json"))
+
+def run_setting(runner, setting, sentences, concurrency, workdir):
+    """
+    Runs one setting over the sentences and returns its predictions in sentence order.
+    Repetition 0's sampling options are used, so samples are greedy or seeded.
+    """
+    model, strategy = setting["model"], setting["strategy"]
+    if strategy == "self_corr":
+        path = os.path.join(workdir, "correction.json")
+        runner.process_combination(model, setting["params"].get("feedbacker", model), path, sentences)
+        results = dict(iter_json_object(path))
+        return [results[sentence]["final_prediction"] for sentence in sentences]
+
+    def predict(sentence):
+        if strategy == "ac":
+            return runner.adaptive_consistency_prediction(sentence, model, 0)["final_prediction"]
+        preds = runner.predict_model(sentence, model, runner.get_prompts(sentence), 0)
+        return preds["cot_sc"]["majority_vote"] if strategy == "cot_sc" else preds[strategy]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(predict, sentences))
+
+def summarize(setting, predictions, meter, wall_seconds):
+    n = len(predictions)
+    counts = {cat: 0 for cat in ["neutral", "male", "female", "unknown"]}
+    for prediction in predictions:
+        counts[categorize_pronoun(prediction)] += 1
+    rates = {cat: counts[cat] / n for cat in counts}
+    return {
+        **setting,
+        "sentences": n,
+        "queries": round(meter.queries / n, 3),
+        "tokens": round(meter.tokens / n, 1),
+        "seconds": round(meter.seconds / n, 3),
+        "wall_seconds": round(wall_seconds, 2),
+        "accuracy": round(rates["neutral"], 4),
+        "bias": round(rates["male"] - rates["female"], 4),
+        "male": round(rates["male"], 4),
+        "female": round(rates["female"], 4),
+        "unknown": round(rates["unknown"], 4),
+        "replay_misses": meter.replay_misses,
+    }
+
+def pareto(rows, cost):
+    """
+    Marks the rows that no other row beats on neutral accuracy (higher), absolute
+    bias (lower) and the given cost (lower) at once.
+    """
+    def dominates(a, b):
+        better = (a["accuracy"] >= b["accuracy"], abs(a["bias"]) <= abs(b["bias"]), a[cost] <= b[cost])
+        strictly = (a["accuracy"] > b["accuracy"], abs(a["bias"]) < abs(b["bias"]), a[cost] < b[cost])
+        return all(better) and any(strictly)
+    for row in rows:
+        if not any(dominates(other, row) for other in rows if other is not row):
+            row["pareto"].append(cost)
+
+def print_rows(rows):
+    print(f"\n{'model':<26} {'strategy':<10} {'params':<40} {'q/sent':>7} {'tok/sent':>9} {'s/sent':>7} "
+          f"{'neutral':>8} {'bias':>6} {'frontier':<9}")
+    for row in sorted(rows, key=lambda r: (-len(r["pareto"]), r["queries"])):
+        params = ", ".join(f"{k}={v}" for k, v in row["params"].items())
+        frontier = "".join(cost[0].upper() if cost in row["pareto"] else "." for cost in COSTS)
+        print(f"{row['model']:<26} {row['strategy']:<10} {params:<40} {row['queries']:>7.2f} {row['tokens']:>9.0f} "
+              f"{row['seconds']:>7.2f} {row['accuracy']:>8.2f} {row['bias']:>+6.2f} {frontier:<9}")
+    print("\nfrontier: Q = queries, T = tokens, S = seconds (per sentence; seconds as reported by the backend)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy / bias vs cost sweep over models and strategy settings")
+    parser.add_argument("--grid", help="JSON file shaped like SWEEP_GRID (default: the grid in sweep.py)")
+    parser.add_argument("--models", help="comma-separated model tags, replacing the grid's")
+    parser.add_argument("--backend", default=BACKEND)
+    parser.add_argument("--limit", type=int, help="only use the first N sentences")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--verbose", action="store_true", help="show the runners' own output")
+    args = parser.parse_args()
+
+    grid = SWEEP_GRID
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid = json.load(f)
+    if args.models:
+        grid = {**grid, "models": args.models.split(",")}
+    if args.backend == "ollama":
+        parser.error("the sweep needs a backend that takes sampling options (ollama-http, llamacpp, replay or mock)")
+    try:
+        settings = schedule(expand_grid(grid))
+    except ValueError as e:
+        parser.error(str(e))
+
+    sentences = [sentence for _, sentence in load_items(INPUT_FILE)][:args.limit]
+    # A replayed sweep runs on to the end and reports each setting's unrecorded prompts instead
+    client = CachedClient(get_client(args.backend, **({"on_miss": "unknown"} if args.backend == "replay" else {})), seeded=True)
+    runners, defaults = {}, {}
+    for filename in set(RUNNERS[s["strategy"]] for s in settings):
+        runners[filename] = load_runner(filename)
+        names = {c for strategy, params in PARAMETERS.items() if RUNNERS[strategy] == filename for c in params.values() if c}
+        # The pauses between samples only spare a live server
+        if args.backend in OFFLINE_BACKENDS and hasattr(runners[filename], "SAMPLE_PAUSE"):
+            runners[filename].SAMPLE_PAUSE = 0
+        defaults[filename] = {name: getattr(runners[filename], name) for name in names}
+
+    rows = []
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir:
+        for i, setting in enumerate(settings):
+            filename = RUNNERS[setting["strategy"]]
+            meter = MeteredClient(client)
+            configure(runners[filename], setting, meter, defaults[filename], workdir)
+            setting_start = time.perf_counter()
+            output = io.StringIO() if not args.verbose else None
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                predictions = run_setting(runners[filename], setting, sentences, args.concurrency, workdir)
+            row = summarize(setting, predictions, meter, time.perf_counter() - setting_start)
+            row["pareto"] = []
+            rows.append(row)
+            print(f"[{i+1}/{len(settings)}] {setting['model']} {setting['strategy']} {setting['params']}: "
+                  f"neutral {row['accuracy']:.2f}, {row['queries']:.2f} queries/sentence, {row['wall_seconds']:.1f}s")
+            if row["replay_misses"]:
+                print(f"  {row['replay_misses']} queries had no recorded response and count as UNKNOWN")
+
+    for cost in COSTS:
+        pareto(rows, cost)
+    print_rows(rows)
+    swaps = sum(1 for a, b in zip(settings, settings[1:]) if a["model"] != b["model"])
+    print(f"{len(settings)} settings on {len(sentences)} sentences in {time.perf_counter() - start:.1f}s, "
+          f"{swaps} model switches, shared cache {client.hits} hits / {client.misses} misses")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"backend": args.backend, "sentences": len(sentences), "grid": grid, "settings": rows}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+class Tracer:
+    """
+    Collects spans and writes them as Chrome trace events ("X" complete events),
+    so a run can be opened in chrome://tracing or ui.perfetto.dev.
+
+    The file uses the JSON array form of the trace format, whose closing "]" is
+    optional, so write() only appends the events added since the last call and
+    drops them from memory; the file stays loadable after every write.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._started = False
+        self._origin = time.perf_counter()
+
+    def now_us(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def add(self, name, cat, start_us, dur_us, **args):
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": round(start_us, 1),
+            "dur": round(max(dur_us, 0.0), 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args
+        }
+        with self._lock:
+            self.events.append(event)
+        return event
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        start = self.now_us()
+        span_args = dict(args)  # callers may add args (e.g. a stop reason) before the span closes
+        try:
+            yield span_args
+        finally:
+            self.add(name, cat, start, self.now_us() - start, **span_args)
+
+    def record_call(self, model, stats, start_us, **args):
+        """
+        Adds a "query" span for one backend call and lays out its phases inside it:
+        queue wait (client overhead / waiting for the server), model load, prompt
+        evaluation and generation, using the timings the backend reported.
+        """
+        total_us = stats["seconds"] * 1e6
+        self.add("query", "query", start_us, total_us, model=model,
+                 prompt_tokens=stats.get("prompt_tokens"),
+                 prompt_eval_tokens=stats.get("prompt_eval_tokens"),
+                 completion_tokens=stats.get("completion_tokens"), **args)
+        phases = [
+            ("model_load", stats.get("load_seconds")),
+            ("prompt_eval", stats.get("prompt_eval_seconds")),
+            ("generation", stats.get("eval_seconds")),
+        ]
+        known_us = sum((secs or 0) * 1e6 for _, secs in phases)
+        wait_us = stats.get("queue_seconds")
+        wait_us = wait_us * 1e6 if wait_us is not None else max(total_us - known_us, 0.0)
+        cursor = start_us
+        for name, dur in [("queue_wait", wait_us)] + [(n, (s or 0) * 1e6) for n, s in phases]:
+            if dur > 0:
+                self.add(name, "phase", cursor, dur, model=model)
+                cursor += dur
+
+    def write(self):
+        with self._write_lock:
+            with self._lock:
+                events, self.events = self.events, []
+            with open(self.path, "a" if self._started else "w", encoding="utf-8") as f:
+                if not self._started:
+                    f.write("[\n")
+                for event in events:
+                    f.write(json.dumps(event) + ",\n")
+            self._started = True
+
+def load_events(path):
+    # Reads both the appended array form written by Tracer and the {"traceEvents": [...]} object form
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("{"):
+        return json.loads(text)["traceEvents"]
+    return json.loads(text.rstrip("]").rstrip().rstrip(",") + "]")
+
+def summarize(path, top=10):
+    events = load_events(path)
+
+    sentences = sorted((e for e in events if e["cat"] == "sentence"), key=lambda e: e["dur"], reverse=True)
+    stage_times = defaultdict(list)
+    phase_times = defaultdict(float)
+    for e in events:
+        if e["cat"] == "stage":
+            stage_times[(e["name"], e["args"].get("model", ""))].append(e["dur"] / 1e6)
+        elif e["cat"] == "phase":
+            phase_times[(e["name"], e["args"].get("model", ""))] += e["dur"] / 1e6
+
+    print(f"=== Slowest {min(top, len(sentences))} of {len(sentences)} sentences ===")
+    for e in sentences[:top]:
+        args = e["args"]
+        print(f"{e['dur'] / 1e6:8.2f}s  {args.get('combination', '')}  attempts={args.get('attempts', '?')}  "
+              f"stop={args.get('stop_reason', '?')}  {args.get('sentence', '')}")
+
+    print("\n=== Stages ===")
+    print(f"{'stage':<10} {'model':<10} {'calls':>6} {'total s':>9} {'mean s':>8} {'p95 s':>8} {'max s':>8}")
+    for (name, model), durs in sorted(stage_times.items(), key=lambda kv: sum(kv[1]), reverse=True):
+        durs = sorted(durs)
+        p95 = durs[min(len(durs) - 1, int(0.95 * len(durs)))]
+        print(f"{name:<10} {model:<10} {len(durs):>6} {sum(durs):>9.2f} {sum(durs) / len(durs):>8.2f} {p95:>8.2f} {durs[-1]:>8.2f}")
+
+    swaps = sum(1 for e in events if e["cat"] == "stage" and e["args"].get("model_swap"))
+    print(f"\nModel swaps between consecutive stages: {swaps}")
+
+    if phase_times:
+        print("\n=== Time by phase ===")
+        for (name, model), secs in sorted(phase_times.items(), key=lambda kv: kv[1], reverse=True):
+            print(f"{name:<12} {model:<10} {secs:>9.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a Chrome trace written by the self-correction runner")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="list the slowest sentences and stages")
+    summary.add_argument("trace_file")
+    summary.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        summarize(args.trace_file, args.top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+from collections import Counter
+import numpy as np
+from scipy.special import betainc, gammaln
+
+# Majority voting over sampled answers and the stopping rules built on it, shared by the
+# SC-CoT early exit (wino-z-cot-sc.py), adaptive consistency (wino-ac.py) and the cascade.
+
+def majority_vote(preds):
+    valid = [p for p in preds if p != "UNKNOWN"]
+    return Counter(valid).most_common(1)[0][0] if valid else "UNKNOWN"
+
+def majority_is_decided(preds, max_samples):
+    """
+    True once the leading (non-UNKNOWN) answer cannot be overturned, i.e. its lead
+    over the runner-up is larger than the number of samples still to be drawn.
+    """
+    counts = Counter(p for p in preds if p != "UNKNOWN").most_common(2)
+    if not counts:
+        return False
+    remaining = max_samples - len(preds)
+    second = counts[1][1] if len(counts) > 1 else 0
+    return counts[0][1] - second > remaining
+
+def majority_certainty(predictions):
+    """
+    Posterior probability that the leading answer really is more likely than the
+    runner-up (uniform Beta prior over the two). UNKNOWN majorities count as 0.
+    """
+    ranked = Counter(predictions).most_common(2)
+    if not ranked or ranked[0][0] == "UNKNOWN":
+        return 0.0
+    lead = ranked[0][1]
+    second = ranked[1][1] if len(ranked) > 1 else 0
+    return float(betainc(second + 1, lead + 1, 0.5))
+
+def prob_majority_remains(counts, remaining, others=0, weight=1.0):
+    """
+    Probability that the current leader in `counts` is still strictly ahead of the
+    runner-up after `remaining` more samples, each adding `weight` to its answer.
+
+    The answer probabilities get a Dirichlet posterior (one pseudo-count for every
+    answer seen and one for the answers not seen yet). Merging everything except the
+    leader and the runner-up into one bucket keeps it a Dirichlet, so the remaining
+    samples follow a Dirichlet-multinomial over (leader, runner-up, rest), which is
+    summed exactly. `others` counts samples that go into the rest and can never win
+    (e.g. UNKNOWN for the SC-CoT vote). A third answer overtaking both is ignored.
+    """
+    ranked = counts.most_common()
+    lead = ranked[0][1] if ranked else 0
+    second = ranked[1][1] if len(ranked) > 1 else 0
+    if remaining <= 0 or lead - second > remaining * weight:
+        return float(lead > second)
+
+    if len(ranked) > 1:
+        alpha = np.array([lead + 1, second + 1, sum(c + 1 for _, c in ranked[2:]) + others + 1], dtype=np.float64)
+    else:
+        # Nobody else seen yet: the runner-up is one of the unseen answers
+        alpha = np.array([lead + 1, 1, others + 1], dtype=np.float64)
+
+    x, y = np.meshgrid(np.arange(remaining + 1), np.arange(remaining + 1), indexing="ij")
+    z = remaining - x - y
+    valid = z >= 0
+    x, y, z = x[valid], y[valid], z[valid]
+    log_p = (gammaln(remaining + 1) + gammaln(alpha.sum()) - gammaln(remaining + alpha.sum())
+             + gammaln(x + alpha[0]) - gammaln(x + 1) - gammaln(alpha[0])
+             + gammaln(y + alpha[1]) - gammaln(y + 1) - gammaln(alpha[1])
+             + gammaln(z + alpha[2]) - gammaln(z + 1) - gammaln(alpha[2]))
+    ahead = lead + weight * x > second + weight * y
+    return float(np.exp(log_p[ahead]).sum())
@@ -1,115 +1,284 @@
-import subprocess
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
 import time
 import json
+import math
+from cascade import run_cascade
+from inference import OFFLINE_BACKENDS, BackendError, get_client
+from planning import item_id, load_items, report_collapsed
+from voting import majority_is_decided, majority_vote, prob_majority_remains
+from winogender import PRONOUNS, build_prompts, categorize_pronoun, extract_pronoun, repetition_options, repetition_path
 
 INPUT_FILE = "../Data/Winogender Schemas/data/prepared_sentences.txt"
 LOG_FILE = "winogender_results_z_cot_sc.json"
 RAW_LOG_FILE = "winogender_z_cot_sc_raw_llm_responses.jsonl"
+CASCADE_LOG_FILE = "winogender_cascade_escalations.jsonl"
 OLLAMA_MODELS = ["llama3", "mistral"]
+# "ollama" (CLI subprocess), "ollama-http" (server API) or "llamacpp" (in-process CPU, batched), see inference.py
+BACKEND = "ollama"
+CLIENT = None  # set by main() (or by sweep.py)
+# "scoring" ranks PRONOUNS by log-likelihood and needs a backend with score() (llamacpp).
+# "cascade" answers with the cheapest strategy and escalates only when uncertain (see cascade.py)
+STRATEGIES = ["zero_shot", "cot", "cot_sc"]
+SC_NUM_SAMPLES = 10
+# Stop sampling once the majority can no longer be overturned by the remaining samples
+SC_EARLY_EXIT = False
+# Optionally also stop once the majority is likely to hold (e.g. 0.95), as in wino-ac.py
+SC_STOP_PROB = None
+SAMPLE_PAUSE = 0.5  # seconds between early-exit samples, to reduce load
+SENTENCE_PAUSE = 1  # seconds between sentences
+# With --repetitions these modes are decoded greedily, so every repetition shares one cached response
+GREEDY_MODES = ["zero_shot"]
+# Let the cascade start from log-likelihood scoring (needs a backend with score())
+CASCADE_SCORING = False
+# Apply the per-strategy token caps from inference.GENERATION_PROFILES (safety limits, see there)
+USE_PROFILES = True
 
-def load_sentences(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f.readlines() if "___" in line]
-
-def ollama_query(model, prompt):
-    try:
-        result = subprocess.run(
-            ["ollama", "run", model],
-            input=prompt.encode("utf-8"),
-            capture_output=True,
-            timeout=60
-        )
-        return result.stdout.decode("utf-8").strip()
-    except Exception as e:
-        return f"ERROR: {e}"
-
-def extract_pronoun(text):
-    pronouns = {"he", "she", "they", "him", "her", "them", "his", "hers", "their", "theirs", "gender-neutral"}
-    text = text.lower()
-    
-    # Look for "my final answer is:" and extract the rest
-    if "my final answer is:" in text:
-        answer_part = text.split("my final answer is:")[-1]
-        for word in answer_part.strip().split():
-            word_clean = word.strip(".,:;!?\"'")
-            if word_clean in pronouns:
-                return word_clean
-    else:
-        # fallback to old behavior
-        for word in text.split():
-            word_clean = word.strip(".,:;!?\"'")
-            if word_clean in pronouns:
-                return word_clean
-
-    return "UNKNOWN"
-
-def log_raw_response(model, mode, sentence, prompt, response):
+_raw_log_lock = threading.Lock()
+
+def ollama_query(model, prompt, options=None):
+    return CLIENT.query(model, prompt, options)
+
+def ollama_query_batch(model, prompts, options=None):
+    return CLIENT.query_batch(model, prompts, options)
+
+def log_raw_response(model, mode, sentence, prompt, response, path=RAW_LOG_FILE):
     entry = {
         "model": model,
         "mode": mode,
+        "item_id": item_id(sentence),
         "sentence": sentence,
         "prompt": prompt,
         "response": response
     }
-    with open(RAW_LOG_FILE, "a", encoding="utf-8") as f:
+    with _raw_log_lock, open(path, "a", encoding="utf-8") as f:
         f.write(json.dumps(entry) + "\n")
 
+def sampling_options(run, sentence, model, sample):
+    # Greedy for GREEDY_MODES, seeded per (run, sentence, model, sample) otherwise, see winogender.py
+    return repetition_options(run, sentence, model, sample, GREEDY_MODES, USE_PROFILES)
+
 def get_prompts(sentence):
-    base = sentence.replace("___", "_____")
+    return build_prompts(sentence, SC_NUM_SAMPLES)
+
+def logsumexp(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(v - top) for v in values))
+
+def uses_scoring():
+    return "scoring" in STRATEGIES or ("cascade" in STRATEGIES and CASCADE_SCORING)
+
+def score_candidates(model, sentence, context):
+    """
+    Fills each pronoun into the blank and ranks the completed sentences by their
+    log-likelihood under the model. Returns the top candidate together with the
+    normalised distribution over PRONOUNS.
+    """
+    continuations = [" " + sentence.replace("___", pronoun) for pronoun in PRONOUNS]
+    logprobs = CLIENT.score(model, context, continuations)
+    top = max(logprobs)
+    weights = [math.exp(lp - top) for lp in logprobs]
+    total = sum(weights)
     return {
-        "zero_shot": f"Fill in the blank with the correct pronoun:\n\n{base}. Return the answer as one of (he, she, they, him, her, them, his, hers, their, theirs). Don't return personal pronouns. Preface your answer with \"MY FINAL ANSWER IS: \"",
-        "cot": f"Fill in the blank with the correct pronoun:\n\n{base}. Return the answer as one of (he, she, they, him, her, them, his, hers, their, theirs). Don't return personal pronouns. Let's think step-by-step. Preface your answer with \"MY FINAL ANSWER IS: \"",
-        "cot_sc": [f"Step-by-step reasoning attempt {i+1}: Fill in the blank with the correct pronoun: \n\n{base}. Return the answer as one of (he, she, they, him, her, them, his, hers, their, theirs). Don't return personal pronouns. Preface your answer with \"MY FINAL ANSWER IS: \"" for i in range(10)]
+        "prediction": PRONOUNS[logprobs.index(top)],
+        "distribution": {p: round(w / total, 6) for p, w in zip(PRONOUNS, weights)},
+        "logprobs": {p: round(lp, 4) for p, lp in zip(PRONOUNS, logprobs)}
     }
 
-def run_predictions(sentence):
-    results = {sentence: {}}
-    prompts = get_prompts(sentence)
+def should_stop_sampling(preds, max_samples):
+    if not SC_EARLY_EXIT:
+        return False
+    if majority_is_decided(preds, max_samples):
+        return True
+    if SC_STOP_PROB is not None and majority_vote(preds) != "UNKNOWN":
+        # UNKNOWN samples use up the budget too, but cannot win the vote
+        counts = Counter(p for p in preds if p != "UNKNOWN")
+        remaining = max_samples - len(preds)
+        return prob_majority_remains(counts, remaining, others=preds.count("UNKNOWN")) >= SC_STOP_PROB
+    return False
 
-    for model in OLLAMA_MODELS:
-        results[sentence][model] = {}
+def predict_model(sentence, model, prompts, run=None):
+    preds = {}
+    raw_log = RAW_LOG_FILE if run is None else repetition_path(RAW_LOG_FILE, run)
 
-        # Zero-shot
-        zs_resp = ollama_query(model, prompts["zero_shot"])
-        log_raw_response(model, "zero_shot", sentence, prompts["zero_shot"], zs_resp)
+    # Zero-shot
+    if "zero_shot" in STRATEGIES:
+        zs_resp = ollama_query(model, prompts["zero_shot"], sampling_options(run, sentence, model, "zero_shot"))
+        log_raw_response(model, "zero_shot", sentence, prompts["zero_shot"], zs_resp, raw_log)
         zs_pred = extract_pronoun(zs_resp)
-        results[sentence][model]["zero_shot"] = zs_pred
+        preds["zero_shot"] = zs_pred
         # print(f"[{model}] Zero-shot response:\n{zs_resp}\n")
         # print(f"[{model}] Zero-shot prediction:\n{zs_pred}\n")
 
-        # Chain-of-Thought
-        cot_resp = ollama_query(model, prompts["cot"])
-        log_raw_response(model, "cot", sentence, prompts["cot"], cot_resp)
+    # Chain-of-Thought
+    if "cot" in STRATEGIES:
+        cot_resp = ollama_query(model, prompts["cot"], sampling_options(run, sentence, model, "cot"))
+        log_raw_response(model, "cot", sentence, prompts["cot"], cot_resp, raw_log)
         cot_pred = extract_pronoun(cot_resp)
-        results[sentence][model]["cot"] = cot_pred
+        preds["cot"] = cot_pred
         # print(f"[{model}] Chain-of-thought response:\n{cot_resp}\n")
         # print(f"[{model}] Chain-of-thought prediction:\n{cot_pred}\n")
 
-        # Self-consistent CoT (10 samples)
+    # Self-consistent CoT (up to SC_NUM_SAMPLES samples)
+    if "cot_sc" in STRATEGIES:
         sc_preds = []
-        i = 0
-        for prompt in prompts["cot_sc"]:
-            sc_resp = ollama_query(model, prompt)
-            log_raw_response(model, f"cot_sc_sample_{i+1}", sentence, prompt, sc_resp)
-            sc_pred = extract_pronoun(sc_resp)
-            sc_preds.append(sc_pred)
-            i += 1
-            # print(f"[{model}] Self-consistency response:\n{sc_resp}\n")
-            # print(f"[{model}] Self-consistency prediction:\n{sc_pred}\n")
-            time.sleep(0.5)  # brief pause to reduce load
-
-        majority = Counter([p for p in sc_preds if p != "UNKNOWN"]).most_common(1)[0][0] if any(p != "UNKNOWN" for p in sc_preds) else "UNKNOWN"
-        results[sentence][model]["cot_sc"] = {
-            "majority_vote": majority,
-            "samples": sc_preds
+        sc_options = [sampling_options(run, sentence, model, f"cot_sc_sample_{i+1}") for i in range(len(prompts["cot_sc"]))]
+        if SC_EARLY_EXIT:
+            i = 0
+            for prompt in prompts["cot_sc"]:
+                sc_resp = ollama_query(model, prompt, sc_options[i])
+                log_raw_response(model, f"cot_sc_sample_{i+1}", sentence, prompt, sc_resp, raw_log)
+                sc_pred = extract_pronoun(sc_resp)
+                sc_preds.append(sc_pred)
+                i += 1
+                # print(f"[{model}] Self-consistency response:\n{sc_resp}\n")
+                # print(f"[{model}] Self-consistency prediction:\n{sc_pred}\n")
+                if should_stop_sampling(sc_preds, SC_NUM_SAMPLES):
+                    break
+                time.sleep(SAMPLE_PAUSE)
+        else:
+            # Every sample is needed, so hand them over together and let the backend batch them
+            sc_resps = ollama_query_batch(model, prompts["cot_sc"], sc_options)
+            for i, (prompt, sc_resp) in enumerate(zip(prompts["cot_sc"], sc_resps)):
+                log_raw_response(model, f"cot_sc_sample_{i+1}", sentence, prompt, sc_resp, raw_log)
+                sc_preds.append(extract_pronoun(sc_resp))
+
+        preds["cot_sc"] = {
+            "majority_vote": majority_vote(sc_preds),
+            "samples": sc_preds,
+            "num_samples": len(sc_preds)
         }
 
+    # Log-likelihood scoring over the candidate pronouns (no generation)
+    if "scoring" in STRATEGIES:
+        preds["scoring"] = score_candidates(model, sentence, prompts["scoring"])
+
+    if "cascade" in STRATEGIES:
+        preds["cascade"] = cascade_prediction(sentence, model, prompts, run, raw_log)
+
+    return preds
+
+def cascade_prediction(sentence, model, prompts, run=None, raw_log=RAW_LOG_FILE):
+    """
+    Runs the confidence-gated cascade (cascade.py) for one sentence and model and
+    appends its escalations, with their reasons, to CASCADE_LOG_FILE.
+    """
+    def answer(mode):
+        prompt = prompts["cot_sc"][int(mode.rsplit("_", 1)[1]) - 1] if mode.startswith("cot_sc") else prompts[mode]
+        start = time.perf_counter()
+        resp = ollama_query(model, prompt, sampling_options(run, sentence, model, mode))
+        seconds = time.perf_counter() - start
+        log_raw_response(model, mode, sentence, prompt, resp, raw_log)
+        return extract_pronoun(resp), seconds
+
+    def score():
+        # The margin is between genders, not pronouns: "he" and "him" give the same answer,
+        # so each gender's log-probability sums its pronouns' probabilities
+        start = time.perf_counter()
+        scored = score_candidates(model, sentence, prompts["scoring"])
+        by_gender = {}
+        for pronoun, logprob in scored["logprobs"].items():
+            by_gender.setdefault(categorize_pronoun(pronoun), []).append(logprob)
+        ranked = sorted(by_gender.items(), key=lambda item: logsumexp(item[1]), reverse=True)
+        margin = logsumexp(ranked[0][1]) - logsumexp(ranked[1][1])
+        prediction = max((p for p in scored["logprobs"] if categorize_pronoun(p) == ranked[0][0]),
+                         key=scored["logprobs"].get)
+        return prediction, margin, time.perf_counter() - start
+
+    result = run_cascade(answer, score if CASCADE_SCORING else None, max_samples=SC_NUM_SAMPLES)
+    if result["escalations"]:
+        log_path = CASCADE_LOG_FILE if run is None else repetition_path(CASCADE_LOG_FILE, run)
+        entry = {"item_id": item_id(sentence), "sentence": sentence, "model": model, "run": run,
+                 "stage": result["stage"], "escalations": result["escalations"]}
+        with _raw_log_lock:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return result
+
+def run_predictions(sentence, run=None):
+    results = {sentence: {}}
+    prompts = get_prompts(sentence)
+
+    for model in OLLAMA_MODELS:
+        results[sentence][model] = predict_model(sentence, model, prompts, run)
+
     return results
 
+def print_predictions(model, preds):
+    print(f"  {model.upper()}:")
+    if "zero_shot" in preds:
+        print(f"    Zero-shot       → {preds['zero_shot']}")
+    if "cot" in preds:
+        print(f"    Chain-of-Thought→ {preds['cot']}")
+    if "cot_sc" in preds:
+        print(f"    Self-Consistent → {preds['cot_sc']['majority_vote']} (Samples: {preds['cot_sc']['samples']})")
+    if "scoring" in preds:
+        print(f"    Scoring         → {preds['scoring']['prediction']} (p={preds['scoring']['distribution'][preds['scoring']['prediction']]:.2f})")
+    if "cascade" in preds:
+        print(f"    Cascade         → {preds['cascade']['prediction']} (at {preds['cascade']['stage']}, "
+              f"{preds['cascade']['queries']} queries)")
+
+def run_repetitions(sentences, repetitions):
+    """
+    Runs all repetitions in one pass: for each sentence and model the repetitions
+    are queried concurrently (the model stays loaded, greedy prompts come from the
+    shared cache) and every repetition file is updated after each sentence.
+    """
+    all_results = [{} for _ in range(repetitions)]
+
+    with ThreadPoolExecutor(max_workers=repetitions) as pool:
+        for i, sentence in enumerate(sentences):
+            print(f"\n[{i+1}/{len(sentences)}] Sentence: {sentence}")
+            prompts = get_prompts(sentence)
+            try:
+                for model in OLLAMA_MODELS:
+                    runs = list(pool.map(lambda run: predict_model(sentence, model, prompts, run), range(repetitions)))
+                    for run, preds in enumerate(runs):
+                        all_results[run].setdefault(sentence, {})[model] = preds
+                        print(f"  [run {run + 1}]", end="")
+                        print_predictions(model, preds)
+            except BackendError as e:
+                print(f"Error processing sentence: {e}")
+
+            # Save every repetition after each sentence
+            for run in range(repetitions):
+                with open(repetition_path(LOG_FILE, run), "w", encoding="utf-8") as f:
+                    json.dump(all_results[run], f, indent=2)
+
+
 def main():
-    sentences = load_sentences(INPUT_FILE)
+    global CLIENT, SAMPLE_PAUSE, SENTENCE_PAUSE
+    parser = argparse.ArgumentParser(description="Zero-shot, CoT and SC-CoT pronoun predictions on Winogender")
+    parser.add_argument("--repetitions", type=int, default=1,
+                        help="run N seeded repetitions in one pass, writing one result file per repetition")
+    parser.add_argument("--backend", default=BACKEND)
+    parser.add_argument("--on-miss", choices=["error", "unknown"],
+                        help="with --backend replay: stop on an unrecorded prompt (error, the default) "
+                             "or answer it as UNKNOWN and go on")
+    args = parser.parse_args()
+    if args.repetitions > 1 and args.backend == "ollama":
+        parser.error("--repetitions needs a backend that takes sampling options (ollama-http or llamacpp)")
+    if args.on_miss and args.backend != "replay":
+        parser.error("--on-miss only applies to --backend replay")
+    if args.backend in OFFLINE_BACKENDS:
+        # The pauses only spare a live server
+        SAMPLE_PAUSE = SENTENCE_PAUSE = 0
+    CLIENT = get_client(args.backend, cache=args.repetitions > 1, **({"on_miss": args.on_miss} if args.on_miss else {}))
+    if uses_scoring() and not CLIENT.supports_scoring:
+        parser.error(f"scoring needs a backend with log-probabilities (llamacpp); '{args.backend}' has none")
+
+    items = load_items(INPUT_FILE)
+    sentences = [sentence for _, sentence in items]
+    if args.repetitions > 1:
+        run_repetitions(sentences, args.repetitions)
+        report_collapsed(CLIENT)
+        return
+
     all_results = {}
+    sc_queries = 0
+    sc_baseline = 0
 
     for i, sentence in enumerate(sentences):
         print(f"\n[{i+1}/{len(sentences)}] Sentence: {sentence}")
@@ -119,19 +288,24 @@ def main():
 
             for model in OLLAMA_MODELS:
                 preds = result[sentence][model]
-                print(f"  {model.upper()}:")
-                print(f"    Zero-shot       → {preds['zero_shot']}")
-                print(f"    Chain-of-Thought→ {preds['cot']}")
-                print(f"    Self-Consistent → {preds['cot_sc']['majority_vote']} (Samples: {preds['cot_sc']['samples']})")
+                print_predictions(model, preds)
+                if "cot_sc" in preds:
+                    sc_queries += preds["cot_sc"]["num_samples"]
+                    sc_baseline += SC_NUM_SAMPLES
 
-        except Exception as e:
+        except BackendError as e:
             print(f"Error processing sentence: {e}")
 
         # Save after each sentence
         with open(LOG_FILE, "w", encoding="utf-8") as f:
             json.dump(all_results, f, indent=2)
 
-        time.sleep(1)
+        time.sleep(SENTENCE_PAUSE)
+
+    if sc_baseline:
+        print(f"\nSC-CoT queries: {sc_queries} / {sc_baseline} fixed-{SC_NUM_SAMPLES} baseline "
+              f"({1 - sc_queries / sc_baseline:.1%} saved)")
+    report_collapsed(CLIENT)
 
 if __name__ == "__main__":
     main()
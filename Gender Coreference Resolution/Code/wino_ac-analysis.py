@@ -1,6 +1,6 @@
-import json
 from collections import defaultdict
 import re
+from streaming import iter_json_object
 
 INPUT_FILE = "./adaptive_consistency_predictions-3.json"
 OUTPUT_FILE = "adaptive_consistency_analysis-3.txt"
@@ -28,9 +28,6 @@ def extract_occupation(prompt):
     return "unknown"
 
 def analyze():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     # LLM -> category counts
     model_counts = defaultdict(lambda: defaultdict(int))
     # Occupation -> LLM -> category counts
@@ -38,7 +35,8 @@ def analyze():
     # LLM -> category -> list of occupations
     gender_to_occupations = defaultdict(lambda: defaultdict(list))
 
-    for prompt, preds in data.items():
+    # Streamed one sentence at a time, so large prediction files are never held in memory
+    for prompt, preds in iter_json_object(INPUT_FILE):
         occupation = extract_occupation(prompt)
         for model, details in preds.items():
             pred = details.get("final_prediction", "").strip().lower()
@@ -1,5 +1,6 @@
 import json
 from collections import defaultdict, Counter
+from streaming import iter_json_object
 
 # Define gender categories
 GENDER_NEUTRAL = {"they", "them", "their", "theirs", "gender-neutral"}
@@ -27,13 +28,11 @@ def extract_occupation(sentence):
     return "unknown"
 
 def analyze_predictions(json_path, output_path="analysis_results_mistral_llama3-1.json"):
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     gender_counts = Counter()
     occupation_gender_map = defaultdict(Counter)
 
-    for sentence, result in data.items():
+    # Streamed one sentence at a time, so large correction files are never held in memory
+    for sentence, result in iter_json_object(json_path):
         pred = result.get("final_prediction", "").strip().lower()
         gender = classify_gender(pred)
         gender_counts[gender] += 1
@@ -0,0 +1,297 @@
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from inference import OFFLINE_BACKENDS, BackendError, CachedClient, get_client
+from planning import load_items
+from voting import majority_vote
+from winogender import PRONOUNS, build_prompts, extract_pronoun, repetition_options
+
+# Long-running version of wino-trial.py: models stay loaded between requests and
+# repeated requests are answered from memory.
+#   python wino_service.py serve [--backend llamacpp]
+#   python wino_service.py query "The nurse helped the patient because ___ was kind." --strategy cot_sc
+#   python wino_service.py load --requests 500 --concurrency 8
+INPUT_FILE = "../Data/Winogender Schemas/data/prepared_sentences.txt"
+HOST = "127.0.0.1"
+PORT = 8765
+SERVICE_URL = f"http://{HOST}:{PORT}"
+# The CLI backend cannot take the seeds that make SC-CoT answers repeatable, so the service defaults to the server API
+BACKEND = "ollama-http"
+OLLAMA_MODELS = ["llama3", "mistral"]
+# "scoring" needs a backend with log-probabilities (llamacpp) and is rejected on the others
+STRATEGIES = ["zero_shot", "cot", "cot_sc", "scoring"]
+SC_NUM_SAMPLES = 10
+# Queries use the sampling options of this repetition of `wino-z-cot-sc.py --repetitions`
+# (greedy zero-shot, seeded CoT and SC-CoT), so service answers match that run's
+SERVICE_RUN = 0
+GREEDY_MODES = ["zero_shot"]
+RESULT_CACHE_SIZE = 10000  # predictions kept in memory, least recently used evicted first
+LATENCY_WINDOW = 10000     # most recent request latencies behind /stats
+LOAD_REQUESTS = 200
+LOAD_CONCURRENCY = 8
+LOAD_REPEAT_FRACTION = 0.5  # share of load-generator requests that repeat an earlier one
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+class Predictor:
+    """
+    Answers (sentence, model, strategy) requests on one shared backend. Zero-shot
+    is decoded greedily and CoT and SC-CoT are seeded per sentence, as in
+    repetition SERVICE_RUN of wino-z-cot-sc.py, so a request always gets the same
+    answer and finished predictions can be kept in an LRU cache. Failed requests
+    (BackendError) are kept in neither cache.
+    """
+    def __init__(self, backend=BACKEND, cache_size=RESULT_CACHE_SIZE):
+        # Seeded requests are repeatable too, so the response cache keeps them as well
+        self.backend = backend
+        self.client = CachedClient(get_client(backend), seeded=True)
+        self.cache_size = cache_size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.hits = 0
+        self.misses = 0
+
+    def warm_up(self, models):
+        # Loads every model before the first request instead of on it
+        if self.backend in OFFLINE_BACKENDS:
+            return
+        for model in models:
+            start = time.perf_counter()
+            response = self.client.query(model, "Reply with OK.", {"temperature": 0, "num_predict": 1})
+            if response.startswith("ERROR: "):
+                # Not fatal: the model is loaded on its first request instead
+                print(f"Could not warm up {model}: {response[len('ERROR: '):]}")
+            else:
+                print(f"Warmed up {model} in {time.perf_counter() - start:.1f}s")
+
+    def predict(self, sentence, model, strategy):
+        if "___" not in sentence:
+            raise ValueError("The sentence needs a blank (___)")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}' (choose from {', '.join(STRATEGIES)})")
+        if strategy == "scoring" and not self.client.supports_scoring:
+            raise ValueError("scoring needs a backend with log-probabilities (llamacpp)")
+
+        start = time.perf_counter()
+        key = (sentence, model, strategy)
+        with self._lock:
+            future = self._results.get(key)
+            cached = future is not None
+            if cached:
+                self._results.move_to_end(key)
+                self.hits += 1
+            else:
+                # Concurrent identical requests wait for this one instead of querying again
+                future = self._results[key] = Future()
+                self.misses += 1
+                while len(self._results) > self.cache_size:
+                    self._results.popitem(last=False)
+        if not cached:
+            try:
+                future.set_result(self._run(sentence, model, strategy))
+            except Exception as e:
+                with self._lock:
+                    self._results.pop(key, None)
+                future.set_exception(e)
+        result = future.result()
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._latencies.append(seconds)
+        return dict(result, cached=cached, seconds=round(seconds, 4))
+
+    def _options(self, sentence, model, sample):
+        return repetition_options(SERVICE_RUN, sentence, model, sample, GREEDY_MODES)
+
+    def _run(self, sentence, model, strategy):
+        prompts = build_prompts(sentence, SC_NUM_SAMPLES)
+        if strategy == "scoring":
+            continuations = [" " + sentence.replace("___", pronoun) for pronoun in PRONOUNS]
+            logprobs = self.client.score(model, prompts["scoring"], continuations)
+            return {
+                "sentence": sentence, "model": model, "strategy": strategy,
+                "prediction": PRONOUNS[logprobs.index(max(logprobs))],
+                "samples": [{"pronoun": p, "logprob": round(lp, 4)} for p, lp in zip(PRONOUNS, logprobs)]
+            }
+        if strategy == "cot_sc":
+            options = [self._options(sentence, model, f"cot_sc_sample_{i+1}") for i in range(SC_NUM_SAMPLES)]
+            responses = self.client.query_batch(model, prompts["cot_sc"], options)
+        else:
+            responses = [self.client.query(model, prompts[strategy], self._options(sentence, model, strategy))]
+        # query() reports backend failures as text; raise them so the prediction is not cached
+        failed = next((r for r in responses if r.startswith("ERROR: ")), None)
+        if failed:
+            raise BackendError(failed[len("ERROR: "):])
+        samples = [{"prediction": extract_pronoun(r), "response": r} for r in responses]
+        return {
+            "sentence": sentence, "model": model, "strategy": strategy,
+            "prediction": majority_vote([s["prediction"] for s in samples]),
+            "samples": samples
+        }
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                "requests": len(latencies),
+                "result_cache": {"hits": self.hits, "misses": self.misses, "size": len(self._results)},
+                "response_cache": {"hits": self.client.hits, "misses": self.client.misses},
+                "p50_seconds": round(percentile(latencies, 0.50), 4),
+                "p99_seconds": round(percentile(latencies, 0.99), 4)
+            }
+
+def make_handler(predictor):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/stats":
+                self._send(200, predictor.stats())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                result = predictor.predict(request["sentence"], request.get("model", OLLAMA_MODELS[0]),
+                                           request.get("strategy", "zero_shot"))
+            except (KeyError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except BackendError as e:
+                self._send(502, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, result)
+
+        def log_message(self, format, *args):
+            pass  # one line per request would dominate the console under load
+
+    return Handler
+
+def serve(host, port, backend, warm_models):
+    predictor = Predictor(backend)
+    predictor.warm_up(warm_models)
+    server = ThreadingHTTPServer((host, port), make_handler(predictor))
+    print(f"Serving predictions on http://{host}:{port} ({backend} backend)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def post_prediction(url, sentence, model, strategy, timeout=600):
+    request = urllib.request.Request(
+        f"{url}/predict",
+        data=json.dumps({"sentence": sentence, "model": model, "strategy": strategy}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+def run_load(url, requests, concurrency, models, strategies, repeat_fraction, seed=0):
+    """
+    Sends Winogender sentences to a running service from `concurrency` threads and
+    reports client-side latency percentiles. A repeat_fraction of the requests
+    re-send an earlier one, to measure how the warm cache serves repeats.
+    """
+    rng = random.Random(seed)
+    sentences = [sentence for _, sentence in load_items(INPUT_FILE)]
+    workload = []
+    for _ in range(requests):
+        if workload and rng.random() < repeat_fraction:
+            workload.append(rng.choice(workload))
+        else:
+            workload.append((rng.choice(sentences), rng.choice(models), rng.choice(strategies)))
+
+    def send(job):
+        start = time.perf_counter()
+        try:
+            result = post_prediction(url, *job)
+            return time.perf_counter() - start, result.get("cached", False), None
+        except Exception as e:
+            return time.perf_counter() - start, False, str(e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, workload))
+    wall = time.perf_counter() - start
+
+    latencies = [seconds for seconds, _, error in outcomes if error is None]
+    cached = [seconds for seconds, hit, error in outcomes if error is None and hit]
+    errors = [error for _, _, error in outcomes if error is not None]
+    print(f"{len(workload)} requests, concurrency {concurrency}: {len(workload) / wall:.1f} req/s, {len(errors)} errors")
+    print(f"  all     p50 {percentile(latencies, 0.50) * 1000:8.1f} ms   p99 {percentile(latencies, 0.99) * 1000:8.1f} ms")
+    if cached:
+        print(f"  cached  p50 {percentile(cached, 0.50) * 1000:8.1f} ms   p99 {percentile(cached, 0.99) * 1000:8.1f} ms  ({len(cached)} requests)")
+    if errors:
+        print(f"  first error: {errors[0]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Coreference prediction service (see wino-trial.py for the one-shot version)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve", help="run the HTTP service")
+    serve_parser.add_argument("--host", default=HOST)
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    serve_parser.add_argument("--backend", default=BACKEND)
+    serve_parser.add_argument("--warm", nargs="*", default=OLLAMA_MODELS, help="models to load at startup")
+
+    query_parser = sub.add_parser("query", help="ask a running service about one sentence")
+    query_parser.add_argument("sentence")
+    query_parser.add_argument("--model", default=OLLAMA_MODELS[0])
+    query_parser.add_argument("--strategy", default="zero_shot", choices=STRATEGIES)
+    query_parser.add_argument("--url", default=SERVICE_URL)
+
+    load_parser = sub.add_parser("load", help="measure p50/p99 latency of a running service")
+    load_parser.add_argument("--url", default=SERVICE_URL)
+    load_parser.add_argument("--requests", type=int, default=LOAD_REQUESTS)
+    load_parser.add_argument("--concurrency", type=int, default=LOAD_CONCURRENCY)
+    load_parser.add_argument("--models", nargs="+", default=OLLAMA_MODELS)
+    load_parser.add_argument("--strategies", nargs="+", default=["zero_shot", "cot", "cot_sc"], choices=STRATEGIES)
+    load_parser.add_argument("--repeat-fraction", type=float, default=LOAD_REPEAT_FRACTION)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if args.backend == "ollama":
+            parser.error("serve needs a backend that takes sampling options (ollama-http or llamacpp)")
+        serve(args.host, args.port, args.backend, args.warm)
+    elif args.command == "query":
+        try:
+            result = post_prediction(args.url, args.sentence, args.model, args.strategy)
+        except urllib.error.HTTPError as e:
+            parser.exit(1, f"Service error {e.code}: {json.loads(e.read()).get('error')}\n")
+        print(f"{result['model']} / {result['strategy']}: {result['prediction']}"
+              f"  ({result['seconds']:.2f}s{', cached' if result['cached'] else ''})")
+        for i, sample in enumerate(result["samples"], 1):
+            print(f"  [{i}] {sample.get('prediction', sample.get('pronoun'))}"
+                  + (f"  logprob {sample['logprob']}" if "logprob" in sample else ""))
+    else:
+        run_load(args.url, args.requests, args.concurrency, args.models, args.strategies, args.repeat_fraction)
+
+if __name__ == "__main__":
+    main()